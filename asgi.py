@@ -0,0 +1,83 @@
+"""Async serving mode, an ASGI app serving the same routes as the Flask app in main.py:
+    uvicorn asgi:app --port 8080
+Connections are handled by one event loop per process instead of a thread each, so idle keep-alive connections and
+requests waiting on their RPCs cost a coroutine rather than a thread. Requests go through the Flask app's own hooks,
+error handlers and session handling. The routes in ASYNC_VIEWS run as native async views that await their independent
+RPCs concurrently, every other view runs unchanged in a pool of ASYNC_THREADS threads, the JWKS fetch a token needs is
+awaited on the event loop first so it doesn't hold a thread. Request profiling is off in this mode, see
+profile_helpers.disable. main.app stays the sync app, served by gunicorn."""
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import request
+import main
+import helpers.asgi_helpers as asgi_helpers
+import helpers.profile_helpers as profile_helpers
+from helpers.controler_helpers import prefetch_jwks
+from controllers.async_controller import ASYNC_VIEWS
+from constants import ASYNC_THREADS
+
+flask_app = main.app
+profile_helpers.disable(flask_app, "views run in worker threads and the event loop runs the profiling hooks")
+
+async def _dispatch(thread_context: contextvars.Context) -> object:
+    """Runs the view of the current request, the async version if there's one. A sync view runs in thread_context,
+    the body it returns is iterated in the same one since stream_with_context pushes the request context there."""
+    view = ASYNC_VIEWS.get(request.endpoint)
+    if view is not None and request.method != "OPTIONS" and request.routing_exception is None:
+        return await view(**request.view_args)
+    await prefetch_jwks(request)
+    loop = asyncio.get_running_loop() # Raises the routing error, if any, like Flask does.
+    return await loop.run_in_executor(None, thread_context.run, flask_app.dispatch_request)
+
+async def _handle(scope: dict, receive: object, send: object):
+    """Serves one http request like Flask's wsgi_app, with the view awaited. The request context stays pushed until
+    the body was sent so teardown hooks run after it, as they do under WSGI."""
+    environ = asgi_helpers.build_environ(scope, await asgi_helpers.read_body(receive))
+    context = flask_app.request_context(environ)
+    error = None
+    context.push()
+    thread_context = contextvars.copy_context()
+    try:
+        try:
+            try:
+                rv = flask_app.preprocess_request()
+                if rv is None:
+                    rv = await _dispatch(thread_context)
+            except Exception as e:
+                rv = flask_app.handle_user_exception(e)
+            response = flask_app.finalize_request(rv)
+        except Exception as e:
+            error = e
+            response = flask_app.handle_exception(e)
+        body, status, headers = response.get_wsgi_response(environ)
+        await asgi_helpers.send_response(send, status, headers, body, not response.is_sequence, thread_context)
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        context.pop(error)
+
+async def _lifespan(receive: object, send: object):
+    """Sizes the thread pool and warms the process up before it takes requests."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            threads = int(os.environ.get("ASYNC_THREADS", ASYNC_THREADS))
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(threads, thread_name_prefix="asgi"))
+            status = await asyncio.to_thread(main.warm_up)
+            flask_app.logger.info(f"{threads} threads, warmup {status}")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope: dict, receive: object, send: object):
+    """ASGI entry point."""
+    if scope["type"] == "http":
+        await _handle(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    else:
+        raise NotImplementedError(f"Unsupported ASGI scope {scope['type']}")
@@ -0,0 +1,199 @@
+"""End to end benchmarks of the hot routes, run through the Flask test client on the in-memory Datastore backend.
+Reports p50/p99 latency, throughput and allocations per scenario as JSON, and compares them against a baseline.
+
+Run from the repository root:
+    python benchmarks/bench_app.py --output baseline.json
+    python benchmarks/bench_app.py --baseline baseline.json --threshold 0.2
+The second run exits with status 1 if a scenario regressed by more than the threshold. Baselines are specific to the
+machine they were recorded on, so record them where the comparison runs. DATASTORE_MEMORY_LATENCY adds simulated RPC
+latency, tokens are signed by a local key served through the JWKS key store so nothing leaves the process."""
+import argparse
+import base64
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Repository root.
+os.environ.setdefault("DATASTORE_BACKEND", "memory") # Before the app builds its client.
+
+import rsa
+from jose import jwt
+from main import app
+import helpers.jwks_helpers as jwks_helpers
+from constants import CLIENT_ID, DOMAIN
+
+JSON = {"Accept": "application/json"}
+PILOT = "auth0|bench-pilot"
+KID = "bench-key"
+SEED_CARGO = 500
+SEED_AIRPLANES = 50
+PAGE_DEPTHS = [1, 20, 80] # Pages of 5 cargo walked before the timed GET.
+COMPARED = {"p50_ms": "lower", "p99_ms": "lower", "ops_per_sec": "higher", "alloc_peak_kib": "lower"}
+
+def _b64uint(value: int) -> str:
+    """Returns an integer as unpadded base64url, the JWK encoding of RSA parameters."""
+    data = value.to_bytes((value.bit_length() + 7) // 8, "big")
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+class Signer:
+    """Local identity provider, signs RS256 tokens and serves its public key through the JWKS key store."""
+
+    def __init__(self, bits: int):
+        public_key, private_key = rsa.newkeys(bits)
+        self.private_pem = private_key.save_pkcs1().decode()
+        jwk = {"kty": "RSA", "kid": KID, "use": "sig", "n": _b64uint(public_key.n), "e": _b64uint(public_key.e)}
+        jwks_helpers._fetch_jwks = lambda: ({KID: jwk}, 3600) # Served instead of fetching from DOMAIN.
+
+    def token(self, sub: str = PILOT) -> str:
+        """Returns a new token for sub, the bench pilot by default, unique so the token cache doesn't know it."""
+        now = int(time.time())
+        claims = {"sub": sub, "aud": CLIENT_ID, "iss": "https://" + DOMAIN + "/", "iat": now, "exp": now + 3600,
+                  "jti": uuid.uuid4().hex}
+        return jwt.encode(claims, self.private_pem, algorithm="RS256", headers={"kid": KID})
+
+def request(client: object, method: str, path: str, expected: int, headers: dict = None, body: object = None) -> dict:
+    """Sends a request through the test client, reads the whole body and checks the status. Returns the JSON body."""
+    response = client.open(path, method=method, headers=headers or JSON, json=body)
+    data = response.get_data()
+    response.close()
+    if response.status_code != expected:
+        raise RuntimeError(f"{method} {path} returned {response.status_code}, expected {expected}: {data[:200]}")
+    return json.loads(data) if data and response.mimetype == "application/json" else None
+
+def seed(client: object, auth: dict) -> dict:
+    """Creates the cargo and airplanes the scenarios read, returns their ids."""
+    cargo = request(client, "POST", "/cargo:batch", 201, body=[{"weight": 10, "item": "crate"}] * SEED_CARGO)
+    airplanes = request(client, "POST", "/airplanes:batch", 201, dict(JSON, **auth),
+                        [{"tail_number": f"N{i}", "type": "B737", "capacity": 1000} for i in range(SEED_AIRPLANES)])
+    return {"cargo": [item["id"] for item in cargo], "airplanes": [item["id"] for item in airplanes]}
+
+def cursor_at(client: object, depth: int) -> str:
+    """Walks depth pages of GET /cargo and returns the path of the next page."""
+    path = "/cargo?limit=5"
+    for _ in range(depth):
+        path = "/cargo" + request(client, "GET", path, 200)["next"].split("/cargo", 1)[1]
+    return path
+
+def traced_runs(iterations: int) -> int:
+    """Returns the number of runs measured under tracemalloc, tracing is slow so a sample is enough."""
+    return max(iterations // 10, 5)
+
+def scenarios(client: object, signer: Signer, ids: dict, runs: int) -> dict:
+    """Returns the scenarios by name, each a function performing one operation, runs is the number of operations
+    each will perform. Reads come first so the writes don't change what they read."""
+    auth = {"Authorization": "Bearer " + signer.token()}
+    cases = {}
+    for depth in PAGE_DEPTHS:
+        path = cursor_at(client, depth)
+        cases[f"get_cargo_cursor_page_{depth}"] = lambda path=path: request(client, "GET", path, 200)
+        offset_path = f"/cargo?limit=5&offset={depth * 5}"
+        cases[f"get_cargo_offset_page_{depth}"] = lambda path=offset_path: request(client, "GET", path, 200)
+
+    cases["get_airplanes"] = lambda: request(client, "GET", "/airplanes", 200, dict(JSON, **auth))
+    tokens = iter([signer.token() for _ in range(runs)]) # Signed up front, outside the timings.
+    cases["get_airplanes_new_token"] = lambda: request(client, "GET", "/airplanes", 200,
+                                                        dict(JSON, Authorization="Bearer " + next(tokens)))
+
+    def assign_remove():
+        airplane_id, cargo_id = ids["airplanes"][0], ids["cargo"][-1]
+        request(client, "PUT", f"/airplanes/{airplane_id}/cargo/{cargo_id}", 204, auth)
+        request(client, "DELETE", f"/airplanes/{airplane_id}/cargo/{cargo_id}", 204, auth)
+    cases["assign_remove_cargo"] = assign_remove
+    cases["post_cargo"] = lambda: request(client, "POST", "/cargo", 201, body={"weight": 10, "item": "crate"})
+    return cases
+
+def measure(operation: object, iterations: int, warmup: int) -> dict:
+    """Runs operation warmup times, then times iterations runs, then runs it again under tracemalloc to measure the
+    peak memory allocated per run."""
+    for _ in range(warmup):
+        operation()
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter_ns()
+        operation()
+        latencies.append((time.perf_counter_ns() - start) / 1e6)
+    elapsed = time.perf_counter() - started
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(traced_runs(iterations)):
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        operation()
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 4),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 4),
+        "mean_ms": round(statistics.fmean(latencies), 4),
+        "ops_per_sec": round(iterations / elapsed, 1),
+        "alloc_peak_kib": round(statistics.median(peaks) / 1024, 2),
+    }
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Returns a line per compared metric and whether it regressed by more than threshold, as (line, regressed)."""
+    lines = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            lines.append((f"{name}: not in baseline", False))
+            continue
+        for metric, better in COMPARED.items():
+            if not previous.get(metric):
+                continue
+            change = (current[metric] - previous[metric]) / previous[metric]
+            regressed = change > threshold if better == "lower" else change < -threshold
+            lines.append((f"{name} {metric}: {previous[metric]} -> {current[metric]} ({change:+.1%})", regressed))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200, help="Timed runs per scenario.")
+    parser.add_argument("--warmup", type=int, default=20, help="Untimed runs per scenario before timing.")
+    parser.add_argument("--scenario", action="append", help="Only run this scenario, may be repeated.")
+    parser.add_argument("--key-bits", type=int, default=1024, help="RSA key size of the local signer.")
+    parser.add_argument("--output", help="Write the results JSON to this file, usable as a later baseline.")
+    parser.add_argument("--baseline", help="Results JSON of a previous run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed regression, 0.2 is 20%%.")
+    args = parser.parse_args()
+
+    client = app.test_client()
+    signer = Signer(args.key_bits)
+    ids = seed(client, {"Authorization": "Bearer " + signer.token()})
+    cases = scenarios(client, signer, ids, args.warmup + args.iterations + traced_runs(args.iterations))
+    unknown = set(args.scenario or []) - set(cases)
+    if unknown:
+        sys.exit(f"Unknown scenarios: {', '.join(sorted(unknown))}, choose from {', '.join(cases)}")
+
+    results = {name: measure(operation, args.iterations, args.warmup) for name, operation in cases.items()
+               if not args.scenario or name in args.scenario}
+    report = {
+        "meta": {"python": platform.python_version(), "backend": os.environ["DATASTORE_BACKEND"],
+                 "latency": os.environ.get("DATASTORE_MEMORY_LATENCY", "0"), "iterations": args.iterations,
+                 "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            lines = compare(results, json.load(baseline)["results"], args.threshold)
+        for line, regressed in lines:
+            print(("REGRESSED " if regressed else "ok        ") + line, file=sys.stderr)
+        if any(regressed for _, regressed in lines):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Compares the sync and async serving modes at the same concurrency and reports the memory each needed for it. The
+sync mode is one gunicorn worker with a thread per concurrent client, the async mode one uvicorn process with a fixed
+pool of ASYNC_THREADS threads. Both run on the in-memory Datastore backend with simulated RPC latency and are loaded
+with the keep-alive clients of bench_serving.py.
+
+Run from the repository root:
+    python benchmarks/bench_async.py --concurrency 16,64,256 --duration 10 --latency 0.005
+For each concurrency the report has requests per second, p50/p99 latency, errors and the peak resident memory of the
+serving processes, sampled during the load. Compare the modes at the concurrency each sustains within the same
+memory. Memory is read from /proc so this only runs on Linux."""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_serving import ROOT, free_port, load, wait_healthy
+from constants import ASYNC_THREADS
+
+SAMPLE_INTERVAL = 0.2 # Seconds between memory samples.
+
+def start_server(mode: str, concurrency: int, port: int, args: argparse.Namespace) -> subprocess.Popen:
+    """Starts the server of mode sized for concurrency, returns once it's healthy."""
+    env = dict(os.environ, PORT=str(port), DATASTORE_BACKEND="memory", DATASTORE_MEMORY_LATENCY=str(args.latency),
+               METRICS_DIR=args.metrics_dir, WEB_CONCURRENCY="1", SERVING_THREADS=str(concurrency),
+               ASYNC_THREADS=str(args.async_threads))
+    if mode == "sync":
+        command = ["-m", "gunicorn", "-c", "serving.py", "main:app"]
+    else:
+        command = ["-m", "uvicorn", "asgi:app", "--port", str(port), "--no-access-log", "--log-level", "warning"]
+    server = subprocess.Popen([sys.executable] + command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, text=True)
+    return wait_healthy(server, port, f"{mode} {concurrency}")
+
+def rss(pid: int) -> int:
+    """Returns the resident memory in bytes of the processes serving requests, the children of pid if it has any
+    (gunicorn's workers, not its master), otherwise pid itself."""
+    with open(f"/proc/{pid}/task/{pid}/children") as children:
+        pids = [int(child) for child in children.read().split()] or [pid]
+    total = 0
+    for serving in pids:
+        with open(f"/proc/{serving}/status") as status:
+            total += next(int(line.split()[1]) * 1024 for line in status if line.startswith("VmRSS:"))
+    return total
+
+def run(mode: str, concurrency: int, args: argparse.Namespace) -> dict:
+    """Benchmarks one mode at one concurrency and returns its results."""
+    port = free_port()
+    server = start_server(mode, concurrency, port, args)
+    peak, done = [rss(server.pid)], threading.Event()
+    
+    def measure():
+        while not done.wait(SAMPLE_INTERVAL):
+            peak.append(rss(server.pid))
+    
+    sampler = threading.Thread(target=measure)
+    sampler.start()
+    try:
+        deadline = time.monotonic() + args.duration
+        shares = [concurrency // args.client_processes + (i < concurrency % args.client_processes)
+                  for i in range(args.client_processes)]
+        with Pool(args.client_processes) as pool:
+            samples = [sample for part in pool.map(load, [(port, share, deadline) for share in shares if share])
+                       for sample in part]
+    finally:
+        done.set()
+        sampler.join()
+        server.terminate()
+        server.communicate(timeout=60)
+
+    latencies = sorted(latency for latency, ok in samples if ok)
+    return {
+        "requests_per_sec": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3) if latencies else None,
+        "errors": sum(not ok for _, ok in samples),
+        "idle_rss_mb": round(peak[0] / 2 ** 20, 1),
+        "peak_rss_mb": round(max(peak) / 2 ** 20, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="sync,async", help="Comma separated modes, sync and/or async.")
+    parser.add_argument("--concurrency", default="16,64,256", help="Comma separated concurrent client counts.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per run.")
+    parser.add_argument("--client-processes", type=int, default=2, help="Processes the clients are spread over.")
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated seconds per Datastore RPC.")
+    parser.add_argument("--async-threads", type=int, default=ASYNC_THREADS, help="Thread pool size of the async mode.")
+    parser.add_argument("--output", help="Write the results JSON to this file.")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as args.metrics_dir:
+        for concurrency in [int(count) for count in args.concurrency.split(",")]:
+            results[concurrency] = {mode: run(mode, concurrency, args) for mode in args.modes.split(",")}
+    report = {"meta": {"cpus": os.cpu_count(), "duration": args.duration, "latency": args.latency,
+                       "async_threads": args.async_threads}, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+if __name__ == "__main__":
+    main()
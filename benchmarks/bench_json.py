@@ -0,0 +1,84 @@
+"""Compares the stdlib and orjson encoders of the app's JSON provider on list pages shaped like GET /airplanes and
+GET /cargo responses. Run from the repository root: python benchmarks/bench_json.py [--entities N] [--repeat R]"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Repository root.
+
+from flask import Flask
+from google.cloud import datastore
+from helpers.json_helpers import FastJSONProvider, orjson
+
+BASE_URL = "https://example.com/"
+
+def make_airplanes(count: int) -> list:
+    """Returns airplane entities like list_airplanes yields, each carrying three cargo."""
+    airplanes = []
+    for i in range(1, count + 1):
+        airplane = datastore.Entity(datastore.Key("Airplane", i, project="bench"))
+        airplane.update({"tail_number": f"N{i:05d}", "type": "B737", "capacity": 3, "pilot": "auth0|bench",
+                         "last_update": datetime.now(), "version": 1, "id": i, "self": f"{BASE_URL}airplanes/{i}",
+                         "cargo": [{"id": i * 10 + c, "self": f"{BASE_URL}cargo/{i * 10 + c}"} for c in range(3)]})
+        airplanes.append(airplane)
+    return airplanes
+
+def make_cargos(count: int) -> list:
+    """Returns cargo entities like list_cargos yields, each with a carrier."""
+    cargos = []
+    for i in range(1, count + 1):
+        cargo = datastore.Entity(datastore.Key("Cargo", i, project="bench"))
+        cargo.update({"weight": 100 + i, "item": "Crate of parts", "last_update": datetime.now(), "version": 1,
+                      "id": i, "self": f"{BASE_URL}cargo/{i}",
+                      "carrier": {"id": i, "name": f"N{i:05d}", "self": f"{BASE_URL}airplanes/{i}"}})
+        cargos.append(cargo)
+    return cargos
+
+def make_provider(fast: bool) -> FastJSONProvider:
+    """Returns a provider of a fresh app, using orjson if fast."""
+    app = Flask(__name__)
+    provider = FastJSONProvider(app)
+    provider.fast = fast
+    return provider
+
+def bench(provider: FastJSONProvider, page: dict, items: list, repeat: int) -> dict:
+    """Times a whole page dumps, a per entity dumps as the streamed responses do, and loads. Milliseconds per call."""
+    body = provider.dumps(page)
+    timings = {
+        "page_dumps": timeit.timeit(lambda: provider.dumps(page), number=repeat),
+        "stream_dumps": timeit.timeit(lambda: [provider.dumps(item) for item in items], number=repeat),
+        "page_loads": timeit.timeit(lambda: provider.loads(body), number=repeat),
+    }
+    return {name: round(seconds / repeat * 1000, 4) for name, seconds in timings.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entities", type=int, default=100, help="Entities per page.")
+    parser.add_argument("--repeat", type=int, default=200, help="Calls timed per measurement.")
+    args = parser.parse_args()
+
+    pages = {"airplanes": make_airplanes(args.entities), "Cargos": make_cargos(args.entities)}
+    encoders = {"stdlib": make_provider(False)}
+    if orjson is not None:
+        encoders["orjson"] = make_provider(True)
+    else:
+        print("orjson is not installed, only the stdlib encoder is measured", file=sys.stderr)
+
+    results = {}
+    for list_name, items in pages.items():
+        page = {list_name: items, "total": len(items), "next": None}
+        outputs = {name: json.loads(provider.dumps(page)) for name, provider in encoders.items()}
+        if len({json.dumps(output, sort_keys=True) for output in outputs.values()}) != 1: # Encoders must agree.
+            sys.exit(f"Encoders produced different documents for {list_name}")
+        results[list_name] = {name: bench(provider, page, items, args.repeat) for name, provider in encoders.items()}
+        if "orjson" in results[list_name]:
+            stdlib, fast = results[list_name]["stdlib"], results[list_name]["orjson"]
+            results[list_name]["speedup"] = {name: round(stdlib[name] / fast[name], 2) for name in stdlib}
+
+    print(json.dumps({"entities": args.entities, "repeat": args.repeat, "results": results}, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Compares the throughput of the production server across worker and thread counts. Each setting starts gunicorn with
+serving.py on the in-memory Datastore backend, whose simulated RPC latency stands in for the I/O wait, loads it with
+keep-alive HTTP clients for a fixed time and reports requests per second, p50/p99 latency and the measured I/O wait.
+
+Run from the repository root:
+    python benchmarks/bench_serving.py --configs 1x1,1x4,2x4,2x8,auto --duration 10 --latency 0.005
+WxT is W workers of T threads, auto is what serving.py derives on this machine. The I/O wait is read from /metrics,
+the share of request time spent in Datastore RPCs. Measure it with 1x1 at a concurrency of 1 where requests don't queue
+for the CPU, and set SERVING_IO_WAIT to it. The workers each keep their own in-memory data, that's fine for throughput
+but the responses differ between workers."""
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from constants import METRICS_FLUSH_INTERVAL
+
+READ = ("GET", "/cargo?limit=5", None)
+WRITE = ("POST", "/cargo", json.dumps({"weight": 10, "item": "crate"}))
+WRITE_EVERY = 10 # One request in this many is a write.
+START_TIMEOUT = 30 # Seconds the server gets to answer its health check.
+
+def free_port() -> int:
+    """Returns a TCP port nothing listens on."""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+def start_server(config: str, port: int, latency: float, metrics_dir: str) -> subprocess.Popen:
+    """Starts gunicorn with serving.py and the worker and thread counts of config, returns once it's healthy."""
+    env = dict(os.environ, PORT=str(port), DATASTORE_BACKEND="memory", DATASTORE_MEMORY_LATENCY=str(latency),
+               METRICS_DIR=metrics_dir)
+    if config != "auto":
+        env["WEB_CONCURRENCY"], env["SERVING_THREADS"] = config.split("x")
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "serving.py", "main:app"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    return wait_healthy(server, port, config)
+
+def wait_healthy(server: subprocess.Popen, port: int, name: str) -> subprocess.Popen:
+    """Returns server once it answers its health check on port, raises if it exits or doesn't within START_TIMEOUT."""
+    deadline = time.monotonic() + START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"{name}: server exited with {server.returncode}: {server.stderr.read()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/healthz")
+            if connection.getresponse().status == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{name}: server didn't become healthy within {START_TIMEOUT}s")
+
+def settings(stderr: str) -> str:
+    """Returns the worker and thread counts the server logged."""
+    match = re.search(r"(\d+) workers, (\d+) threads", stderr)
+    return f"{match.group(1)}x{match.group(2)}" if match else "?"
+
+def _client(port: int, deadline: float, results: list):
+    """Sends requests over one keep-alive connection until deadline, appends (latency ms, ok) to results."""
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    sent = 0
+    while time.monotonic() < deadline:
+        method, path, body = WRITE if sent % WRITE_EVERY == WRITE_EVERY - 1 else READ
+        sent += 1
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers={"Accept": "application/json",
+                                                                 "Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            ok = False
+        results.append(((time.perf_counter() - start) * 1000, ok))
+
+def load(args: tuple) -> list:
+    """Pool target, runs clients threads against port until deadline and returns their (latency ms, ok) samples."""
+    port, clients, deadline = args
+    results = []
+    threads = [threading.Thread(target=_client, args=(port, deadline, results)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+def io_wait(port: int, requests: int) -> float:
+    """Returns the share of request time spent in Datastore RPCs, from /metrics once every worker flushed."""
+    time.sleep(METRICS_FLUSH_INTERVAL + 0.5)
+    for _ in range(requests): # Flushes happen at the end of a request.
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        connection.request("GET", "/healthz")
+        connection.getresponse().read()
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.request("GET", "/metrics")
+    text = connection.getresponse().read().decode()
+    sums = {"datastore_rpc_duration_seconds_sum": 0.0, "http_request_duration_seconds_sum": 0.0}
+    for line in text.splitlines():
+        name = line.split("{", 1)[0]
+        if name in sums:
+            sums[name] += float(line.rsplit(" ", 1)[1])
+    requests_time = sums["http_request_duration_seconds_sum"]
+    return round(sums["datastore_rpc_duration_seconds_sum"] / requests_time, 3) if requests_time else None
+
+def run(config: str, args: argparse.Namespace) -> dict:
+    """Benchmarks one setting and returns its results."""
+    port = free_port()
+    with tempfile.TemporaryDirectory() as metrics_dir:
+        server = start_server(config, port, args.latency, metrics_dir)
+        try:
+            deadline = time.monotonic() + args.duration
+            shares = [args.concurrency // args.client_processes + (i < args.concurrency % args.client_processes)
+                      for i in range(args.client_processes)]
+            with Pool(args.client_processes) as pool:
+                samples = [sample for part in pool.map(load, [(port, share, deadline) for share in shares if share])
+                           for sample in part]
+            measured = io_wait(port, args.concurrency)
+        finally:
+            server.terminate() # Graceful shutdown, in-flight requests finish.
+            _, stderr = server.communicate(timeout=60)
+
+    latencies = sorted(latency for latency, ok in samples if ok)
+    return {
+        "settings": settings(stderr),
+        "requests_per_sec": round(len(latencies) / args.duration, 1),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3) if latencies else None,
+        "errors": sum(not ok for _, ok in samples),
+        "io_wait": measured,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--configs", default="1x1,1x4,2x4,2x8,auto", help="Comma separated WxT settings or auto.")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load per setting.")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent keep-alive clients.")
+    parser.add_argument("--client-processes", type=int, default=2, help="Processes the clients are spread over.")
+    parser.add_argument("--latency", type=float, default=0.005, help="Simulated seconds per Datastore RPC.")
+    parser.add_argument("--output", help="Write the results JSON to this file.")
+    args = parser.parse_args()
+
+    results = {config: run(config, args) for config in args.configs.split(",")}
+    report = {"meta": {"cpus": os.cpu_count(), "duration": args.duration, "concurrency": args.concurrency,
+                       "latency": args.latency}, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+if __name__ == "__main__":
+    main()
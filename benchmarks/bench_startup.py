@@ -0,0 +1,67 @@
+"""Guards the cold start budget, measures how long importing the app takes in fresh interpreters and checks the heavy
+modules are left to first use.
+
+Run from the repository root:
+    python benchmarks/bench_startup.py --runs 5 --budget-ms 800
+Exits with status 1 if the median import time of main is over the budget or if importing main imported one of the
+DEFERRED modules, and lists the slowest imports to look at. Import times depend on the machine and on whether the
+bytecode is cached, the first run compiles it and isn't counted."""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules importing main must not import, they're imported on first use or by the warmup request.
+DEFERRED = ["google.cloud.datastore", "google.api_core", "grpc", "google.protobuf", "google.auth", "jose", "authlib"]
+
+PROBE = "import json, sys; import main; print(json.dumps([name for name in sys.argv[1:] if name in sys.modules]))"
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+def import_main() -> tuple:
+    """Imports main in a fresh interpreter with -X importtime. Returns the import times as (self us, cumulative us,
+    depth, module) and the DEFERRED modules that were imported."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE] + DEFERRED, cwd=ROOT, capture_output=True,
+                            text=True, check=True)
+    times = [(int(own), int(cumulative), len(indent) // 2, module)
+             for own, cumulative, indent, module in IMPORT_LINE.findall(result.stderr)]
+    return times, json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters measured.")
+    parser.add_argument("--budget-ms", type=float, default=800, help="Allowed median import time of main.")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports listed.")
+    args = parser.parse_args()
+
+    import_main() # Compiles and caches the bytecode.
+    runs = [import_main() for _ in range(args.runs)]
+    totals = [next(cumulative for _, cumulative, _, module in times if module == "main") / 1000 for times, _ in runs]
+    imported = sorted({module for _, modules in runs for module in modules})
+    slowest = sorted(runs[-1][0], key=lambda row: row[0], reverse=True)[:args.top]
+
+    median = statistics.median(totals)
+    report = {
+        "import_main_ms": {"median": round(median, 1), "min": round(min(totals), 1), "max": round(max(totals), 1)},
+        "budget_ms": args.budget_ms,
+        "deferred_imported": imported,
+        "slowest_self_ms": {module: round(own / 1000, 2) for own, _, _, module in slowest},
+    }
+    print(json.dumps(report, indent=2))
+
+    failures = []
+    if median > args.budget_ms:
+        failures.append(f"importing main took {median:.0f}ms, over the {args.budget_ms:.0f}ms budget")
+    if imported:
+        failures.append(f"importing main imported {', '.join(imported)}, they should be imported on first use")
+    for failure in failures:
+        print("FAILED " + failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Checks the async serving mode answers like the sync app, by driving asgi.app in process and comparing each
+response with the one main.app gives through its test client, on the in-memory Datastore backend.
+
+Run from the repository root:
+    python benchmarks/check_asgi.py
+Covers a native async view, sync views run in the thread pool, a streamed body and a routing error. Exits with status 1
+and lists the differences if any response's status, content type or body differs."""
+import asyncio
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATASTORE_BACKEND", "memory")
+
+import asgi
+import main as sync_app
+import models.user_model as user_model
+
+CRON = {"X-Appengine-Cron": "true"} # Passes the admin check of /users:export.
+REQUESTS = [
+    ("POST", "/cargo", {"Accept": "application/json"}, {"weight": 10, "item": "crate"}),
+    ("POST", "/cargo", {"Accept": "application/json"}, {"weight": 20, "item": "barrel"}),
+    ("GET", "/cargo?limit=1", {"Accept": "application/json"}, None), # Native async view.
+    ("GET", "/cargo?limit=5", {"Accept": "application/x-ndjson"}, None),
+    ("GET", "/users:export", CRON, None), # Streamed with stream_with_context.
+    ("GET", "/users", {}, None),
+    ("GET", "/airplanes", {"Accept": "application/json"}, None), # No token.
+    ("GET", "/no-such-route", {}, None),
+]
+
+async def call_asgi(method: str, path: str, headers: dict, body: bytes) -> tuple:
+    """Sends one request to asgi.app, returns its status, content type and body."""
+    path, _, query = path.partition("?")
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(), "root_path": "",
+             "scheme": "http", "http_version": "1.1", "server": ("localhost", 80), "client": ("127.0.0.1", 1),
+             "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]}
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi.app(scope, receive, send)
+    start = sent[0]
+    content_type = dict(start["headers"]).get(b"content-type", b"").decode()
+    return start["status"], content_type, b"".join(message.get("body", b"") for message in sent[1:])
+
+def call_wsgi(method: str, path: str, headers: dict, body: bytes) -> tuple:
+    """Sends one request to main.app, returns its status, content type and body."""
+    response = sync_app.app.test_client().open(path, method=method, headers=headers, data=body)
+    return response.status_code, response.content_type, response.get_data()
+
+async def compare() -> list:
+    """Sends every request to both apps in turn and returns the differences."""
+    for sub in ("auth0|check-1", "auth0|check-2"): # Users for the export to stream.
+        user_model.create_user(sub)
+    differences = []
+    for method, path, headers, payload in REQUESTS:
+        body = json.dumps(payload).encode() if payload is not None else b""
+        if payload is not None:
+            headers = dict(headers, **{"Content-Type": "application/json", "Content-Length": str(len(body))})
+        expected = call_wsgi(method, path, headers, body)
+        got = await call_asgi(method, path, headers, body)
+        if method == "POST": # Creates differ by id, compare the status only.
+            expected, got = expected[:2], got[:2]
+        if got != expected:
+            differences.append(f"{method} {path}: sync {expected!r}, async {got!r}")
+    return differences
+
+def main():
+    differences = asyncio.run(compare())
+    print(json.dumps({"requests": len(REQUESTS), "differences": differences}, indent=2))
+    if differences:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Replays a JSONL log of API calls against the app and reports latency histograms per route template.
+
+Each log line is an object with method, path (with query string), and optionally headers, body (JSON), t (seconds
+since the start of the log, or timestamp as epoch seconds or ISO 8601), status and response, the recorded status and
+JSON body. Ids created during the replay replace the recorded ones in later paths, cargo_ids bodies and cursors, which
+needs the recorded response of the creating call. A call using an id that's still being created waits for it, calls
+on the same airplane or cargo keep their recorded order and a list call waits for the creates and deletes of its kind
+recorded before it. A call whose cursor the replay didn't produce, the page had no next url, is skipped.
+
+Run from the repository root:
+    python benchmarks/replay.py traffic.jsonl --speed 1 --workers 8
+    python benchmarks/replay.py traffic.jsonl --speed 0 --target https://staging.example.com --output report.json
+--speed 1 keeps the recorded pacing, N replays N times faster and 0 as fast as the workers allow. Without --target the
+calls go to the app in this process on the in-memory backend, where --local-auth re-signs each recorded token for the
+same sub with a local key. benchmarks/sample_traffic.jsonl shows the format."""
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # Repository root.
+os.environ.setdefault("DATASTORE_BACKEND", "memory") # Before the app builds its client.
+
+from werkzeug.exceptions import HTTPException
+from main import app
+
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000] # Histogram upper bounds, plus one for slower.
+CREATES = {"/airplanes": "airplane_id", "/airplanes:batch": "airplane_id", "/cargo": "cargo_id",
+           "/cargo:batch": "cargo_id"} # Route templates whose POST creates ids, and the argument the ids go in.
+LISTS = {"/airplanes": "airplane_id", "/cargo": "cargo_id"} # Route templates whose GET lists a kind of entity.
+BODY_IDS = {"cargo_ids": "cargo_id"} # Body fields holding lists of ids.
+WAIT_TIMEOUT = 30 # Seconds a call waits for an id another call is creating.
+
+def _offset(entry: dict) -> float:
+    """Returns the recorded time of entry in seconds, from t or timestamp."""
+    if "t" in entry:
+        return float(entry["t"])
+    timestamp = entry.get("timestamp", 0)
+    if isinstance(timestamp, str):
+        return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+    return float(timestamp)
+
+def load_log(path: str) -> list:
+    """Reads the log and returns its calls in recorded order with at, the seconds since the first call."""
+    with open(path) as log:
+        entries = [json.loads(line) for line in log if line.strip()]
+    if not entries:
+        return []
+    for entry in entries:
+        entry["at"] = _offset(entry)
+    entries.sort(key=lambda entry: entry["at"])
+    start = entries[0]["at"]
+    for entry in entries:
+        entry["at"] -= start
+    return entries
+
+def match(method: str, path: str) -> tuple:
+    """Returns the route template matching path, like /airplanes/<airplane_id>, its endpoint and the path arguments."""
+    try:
+        rule, args = app.url_map.bind("localhost").match(urlsplit(path).path, method=method, return_rule=True)
+    except HTTPException:
+        return "<unmatched>", None, {}
+    return rule.rule, rule.endpoint, args
+
+def _cursor(url: str) -> str:
+    """Returns the cursor of a next url, or None."""
+    return dict(parse_qsl(urlsplit(url).query)).get("cursor") if url else None
+
+def _created(body: object) -> list:
+    """Returns the ids a create call returned, None for failed items of a batch."""
+    items = body if isinstance(body, list) else [body]
+    return [item.get("id") if isinstance(item, dict) else None for item in items]
+
+class Unresolved(LookupError):
+    """A recorded cursor the replay didn't produce."""
+
+class IdMap:
+    """Recorded ids and cursors to those of the replay. Values produced by a call still in flight are pending and
+    lookups wait for them."""
+
+    def __init__(self):
+        self._values = {}
+        self._pending = set()
+        self._condition = threading.Condition()
+
+    def expect(self, name: str, recorded: object):
+        """Marks a recorded value as produced by a call that hasn't run yet."""
+        if recorded is not None:
+            self._pending.add((name, str(recorded)))
+
+    def resolve(self, name: str, recorded: object, replayed: object):
+        """Maps a recorded value to its replayed value, None if the replay produced none."""
+        if recorded is None:
+            return
+        with self._condition:
+            key = (name, str(recorded))
+            self._values[key] = str(replayed) if replayed is not None else None
+            self._pending.discard(key)
+            self._condition.notify_all()
+
+    def lookup(self, name: str, recorded: object, required: bool = False) -> str:
+        """Returns the replayed value for a recorded one, waiting if it's pending. Unknown values are kept, as are
+        those the replay produced none for unless required, then Unresolved is raised."""
+        key = (name, str(recorded))
+        with self._condition:
+            self._condition.wait_for(lambda: key not in self._pending, timeout=WAIT_TIMEOUT)
+            value = self._values.get(key, str(recorded))
+        if value is None:
+            if required:
+                raise Unresolved(f"no replayed {name} for {recorded}")
+            return str(recorded)
+        return value
+
+def plan(entries: list, ids: IdMap):
+    """Registers every id and cursor the log's calls will produce as pending."""
+    for entry in entries:
+        entry["template"], entry["endpoint"], entry["args"] = match(entry["method"], entry["path"])
+        response = entry.get("response")
+        if entry["method"] == "POST" and entry["template"] in CREATES and response is not None:
+            for recorded in _created(response):
+                ids.expect(CREATES[entry["template"]], recorded)
+        if isinstance(response, dict):
+            ids.expect("cursor", _cursor(response.get("next")))
+
+def rewrite(entry: dict, ids: IdMap) -> tuple:
+    """Returns the path and body of a call with recorded ids and cursors replaced by those of the replay."""
+    parts = urlsplit(entry["path"])
+    path, query = parts.path, parse_qsl(parts.query)
+    if entry["args"]:
+        args = {name: ids.lookup(name, value) if name in ("airplane_id", "cargo_id") else value
+                for name, value in entry["args"].items()}
+        path = app.url_map.bind("localhost").build(entry["endpoint"], args, method=entry["method"])
+    query = [(name, ids.lookup("cursor", value, required=True) if name == "cursor" else value) for name, value in query]
+    path += "?" + urlencode(query) if query else ""
+
+    body = entry.get("body")
+    if isinstance(body, dict):
+        body = dict(body)
+        for field, name in BODY_IDS.items():
+            if isinstance(body.get(field), list):
+                body[field] = [ids.lookup(name, value) for value in body[field]]
+    return path, body
+
+def resources(entry: dict) -> set:
+    """Returns the recorded airplanes and cargo a call touches. Calls sharing one run in recorded order, so a remove
+    doesn't overtake the assign before it. Calls run in a FIFO pool, so those waited on have always started."""
+    touched = {(name, str(value)) for name, value in entry["args"].items() if name in ("airplane_id", "cargo_id")}
+    body = entry.get("body")
+    if isinstance(body, dict):
+        for field, name in BODY_IDS.items():
+            if isinstance(body.get(field), list):
+                touched.update((name, str(value)) for value in body[field])
+    return touched
+
+def list_writes(entry: dict) -> set:
+    """Returns the kinds, by id name, whose lists the call adds to or removes from."""
+    if entry["method"] == "POST" and entry["template"] in CREATES:
+        return {CREATES[entry["template"]]}
+    if entry["method"] == "DELETE" and len(entry["args"]) == 1: # Deletes an airplane or a cargo.
+        return set(entry["args"])
+    return set()
+
+def list_reads(entry: dict) -> set:
+    """Returns the kinds, by id name, the call lists."""
+    return {LISTS[entry["template"]]} if entry["method"] == "GET" and entry["template"] in LISTS else set()
+
+def learn(entry: dict, body: object, ids: IdMap):
+    """Maps the ids and cursor the recorded call produced to those the replayed call returned."""
+    response = entry.get("response")
+    if entry["method"] == "POST" and entry["template"] in CREATES and response is not None:
+        replayed = _created(body) if body is not None else []
+        for i, recorded in enumerate(_created(response)):
+            ids.resolve(CREATES[entry["template"]], recorded, replayed[i] if i < len(replayed) else None)
+    if isinstance(response, dict):
+        replayed_next = body.get("next") if isinstance(body, dict) else None
+        ids.resolve("cursor", _cursor(response.get("next")), _cursor(replayed_next))
+
+class InProcessSender:
+    """Sends calls to the app through a Flask test client per worker thread."""
+
+    def __init__(self, local_auth: bool):
+        self._local = threading.local()
+        self._signer = None
+        self._tokens = {}
+        if local_auth:
+            from benchmarks.bench_app import Signer, PILOT
+            self._signer = Signer(1024)
+            self._default_sub = PILOT
+
+    def _headers(self, headers: dict) -> dict:
+        """Replaces a recorded bearer token with one signed locally for the same sub."""
+        authorization = headers.get("Authorization", "")
+        if not self._signer or not authorization.startswith("Bearer "):
+            return headers
+        token = authorization[len("Bearer "):]
+        if token not in self._tokens:
+            from jose import jwt
+            self._tokens[token] = self._signer.token(jwt.get_unverified_claims(token).get("sub", self._default_sub))
+        return dict(headers, Authorization="Bearer " + self._tokens[token])
+
+    def send(self, method: str, path: str, headers: dict, body: object) -> tuple:
+        """Returns the status and body of the call."""
+        if not hasattr(self._local, "client"):
+            self._local.client = app.test_client(use_cookies=False)
+        response = self._local.client.open(path, method=method, headers=self._headers(headers), json=body)
+        data = response.get_data()
+        response.close()
+        return response.status_code, data
+
+class HttpSender:
+    """Sends calls to a deployed app, with a keep-alive session per worker thread."""
+
+    def __init__(self, target: str):
+        self._target = target.rstrip("/")
+        self._local = threading.local()
+
+    def send(self, method: str, path: str, headers: dict, body: object) -> tuple:
+        """Returns the status and body of the call."""
+        import requests
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        response = self._local.session.request(method, self._target + path, headers=headers, json=body)
+        return response.status_code, response.content
+
+class Recorder:
+    """Latencies and statuses per route template."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.mismatches = Counter()
+        self.max_lag = 0.0
+
+    def add(self, route: str, latency_ms: float, status: object, expected: int, lag: float):
+        """Records one call, latency_ms is None if it failed before getting a response."""
+        with self._lock:
+            latencies = self.latencies[route] # Listed even if every call failed.
+            if latency_ms is not None:
+                latencies.append(latency_ms)
+            self.statuses[route][str(status)] += 1
+            if expected is not None and status != expected:
+                self.mismatches[route] += 1
+            self.max_lag = max(self.max_lag, lag)
+
+    def report(self) -> dict:
+        """Returns the histogram, percentiles and statuses of every route."""
+        routes = {}
+        for route, latencies in sorted(self.latencies.items()):
+            latencies = sorted(latencies) or [float("nan")] # Every call failed.
+            histogram = Counter()
+            for latency in latencies:
+                bound = next((bucket for bucket in BUCKETS_MS if latency <= bucket), None)
+                histogram[f"<={bound}ms" if bound else f">{BUCKETS_MS[-1]}ms"] += 1
+            routes[route] = {
+                "count": len(latencies),
+                "p50_ms": round(statistics.median(latencies), 3),
+                "p90_ms": round(latencies[int(len(latencies) * 0.9)], 3),
+                "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+                "max_ms": round(latencies[-1], 3),
+                "histogram": dict(histogram),
+                "statuses": dict(self.statuses[route]),
+                "status_mismatches": self.mismatches[route],
+            }
+        return routes
+
+def replay(entries: list, sender: object, speed: float, workers: int) -> dict:
+    """Replays entries with the recorded pacing divided by speed, or back to back if speed is 0."""
+    ids = IdMap()
+    plan(entries, ids)
+    recorder = Recorder()
+
+    def run(entry: dict, scheduled: float, after: list, done: threading.Event):
+        for previous in after: # Earlier calls on the same airplanes or cargo.
+            previous.wait(WAIT_TIMEOUT)
+        lag = time.perf_counter() - scheduled
+        route = entry["method"] + " " + entry["template"]
+        body = None
+        try:
+            path, request_body = rewrite(entry, ids)
+            start = time.perf_counter()
+            status, data = sender.send(entry["method"], path, entry.get("headers") or {}, request_body)
+            latency = (time.perf_counter() - start) * 1000
+            try:
+                body = json.loads(data) if data else None
+            except ValueError: # Not JSON, e.g. NDJSON or HTML.
+                body = None
+            recorder.add(route, latency, status, entry.get("status"), lag)
+        except Unresolved: # Its page had no next url in the replay, sending the recorded cursor would only fail.
+            recorder.add(route, None, "skipped", None, lag)
+        except Exception as e:
+            recorder.add(route, None, "error: " + type(e).__name__, entry.get("status"), lag)
+        finally:
+            learn(entry, body, ids) # Always, so calls waiting on this one are released.
+            done.set()
+
+    last_call = {} # Resource to the done event of the last call submitted on it.
+    writes = defaultdict(list) # Kind to the done events of its creates and deletes that may still run.
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for entry in entries:
+            scheduled = started + (entry["at"] / speed if speed > 0 else 0)
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            done = threading.Event()
+            after = [last_call[resource] for resource in resources(entry) if resource in last_call]
+            after += [write for kind in list_reads(entry) for write in writes[kind]] # A list sees earlier writes.
+            last_call.update((resource, done) for resource in resources(entry))
+            for kind in list_writes(entry):
+                writes[kind] = [write for write in writes[kind] if not write.is_set()] + [done]
+            pool.submit(run, entry, max(scheduled, started), after, done)
+    elapsed = time.perf_counter() - started
+
+    return {"calls": len(entries), "elapsed_s": round(elapsed, 3), "calls_per_sec": round(len(entries) / elapsed, 1),
+            "max_lag_ms": round(recorder.max_lag * 1000, 3), "routes": recorder.report()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="JSONL log of API calls.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Pacing multiplier, 0 replays as fast as possible.")
+    parser.add_argument("--workers", type=int, default=4, help="Calls in flight at once.")
+    parser.add_argument("--target", help="Base url of a deployed app, the app in this process if not passed.")
+    parser.add_argument("--local-auth", action="store_true", help="Re-sign recorded tokens with a local key.")
+    parser.add_argument("--output", help="Write the report JSON to this file.")
+    args = parser.parse_args()
+
+    sender = HttpSender(args.target) if args.target else InProcessSender(args.local_auth)
+    report = replay(load_log(args.log), sender, args.speed, args.workers)
+    report.update({"speed": args.speed, "workers": args.workers, "target": args.target or "in-process"})
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,103 @@
-# Update the values of the first 3 variables for your own application.
+# Update the values of the first 3 variables and CURSOR_SECRET for your own application.
 CLIENT_ID = ""
 CLIENT_SECRET = ""
 DOMAIN = ""
 ALGORITHMS = ["RS256"]
+CURSOR_SECRET = "" # Key signing the page cursors returned in next urls, set a long random value.
+ADMIN_SUBS = [] # Subs of the users allowed to call the admin routes.
+
+# JWKS key store settings, in seconds.
+JWKS_DEFAULT_MAX_AGE = 600 # Used when the identity provider sends no Cache-Control max-age.
+JWKS_REFRESH_MARGIN = 60 # Background refresh runs this long before the cached keys expire.
+JWKS_MIN_REFETCH_INTERVAL = 30 # Minimum time between refetches triggered by an unknown kid.
+JWKS_FETCH_TIMEOUT = 5
+
+# Verified token cache settings.
+TOKEN_CACHE_SIZE = 4096 # Verified payloads, each kept until the token's exp.
+TOKEN_NEGATIVE_CACHE_SIZE = 4096 # Malformed or rejected tokens.
+TOKEN_NEGATIVE_CACHE_TTL = 300 # Seconds a rejected token is remembered.
+
+# Entity counters used for the total field of list responses.
+COUNTER_SHARDS = 8 # Shards per counter, more shards allow more concurrent creates and deletes.
+EXACT_TOTALS = False # True counts with a query on every list request instead of reading the counters.
+
+# Datastore client settings, the DATASTORE_BACKEND environment variable overrides the backend.
+DATASTORE_BACKEND = "cloud" # "cloud", "emulator" or "memory" which keeps the data in this process.
+DATASTORE_EMULATOR_HOST = "localhost:8081" # Used when no DATASTORE_EMULATOR_HOST environment variable is set.
+DATASTORE_MEMORY_LATENCY = 0.0 # Seconds slept per RPC by the memory backend, the environment variable overrides it.
+GRPC_CHANNEL_OPTIONS = {
+    "grpc.keepalive_time_ms": 60000, # Ping idle connections so they aren't dropped between requests.
+    "grpc.keepalive_timeout_ms": 20000,
+    "grpc.keepalive_permit_without_calls": 1,
+    "grpc.http2.max_pings_without_data": 0,
+    "grpc.max_send_message_length": 16 * 1024 * 1024, # Large enough for 500 entity commits.
+    "grpc.max_receive_message_length": 32 * 1024 * 1024,
+}
+
+# Transaction retries on contention, backoff in seconds doubles every attempt up to the max.
+TRANSACTION_RETRIES = 4
+TRANSACTION_BACKOFF_BASE = 0.05
+TRANSACTION_BACKOFF_MAX = 1.0
+
+# Maximum number of cargo ids per batch assign request, one transaction holds them all.
+BATCH_ASSIGN_LIMIT = 100
+
+# Batch create settings, Datastore takes at most 500 entities per commit or allocate_ids call.
+BATCH_CREATE_LIMIT = 1000
+DATASTORE_MAX_BATCH = 500
+
+# Airplane and Cargo entity cache, off by default. Every instance and worker must see the same cache, otherwise they
+# serve an entity and its ETag for up to the TTL after another one changed it. Only enable it with "redis" pointed at
+# a server every instance uses, e.g. Memorystore, it needs the redis package. "local" keeps entries per process, it's
+# for a single process and turned off anyway when WEB_CONCURRENCY is over 1.
+ENTITY_CACHE_ENABLED = False
+ENTITY_CACHE_BACKEND = "local"
+ENTITY_CACHE_REDIS_URL = "redis://localhost:6379/0"
+ENTITY_CACHE_SIZE = 10000
+ENTITY_CACHE_TTL = 30 # Seconds.
+
+# Subs known to have a User entity, remembered so logins skip Datastore.
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 3600 # Seconds.
+
+# JSON encoder of the app, "orjson" when the orjson package is installed otherwise the stdlib, or "stdlib" to force it.
+JSON_ENCODER = "orjson"
+
+# GET /users page size, limit is capped at the max.
+USERS_PAGE_SIZE = 20
+USERS_LIMIT_MAX = 100
+
+# Request profiling, the PROFILE_SAMPLE_RATE environment variable overrides the rate. Reports are at /admin/profiles.
+PROFILE_SAMPLE_RATE = 0.0 # Fraction of requests profiled, 1.0 profiles every request.
+PROFILE_HEADER = "X-Profile" # Admin requests sending this header set to 1 are always profiled.
+PROFILE_TOP_FUNCTIONS = 25 # Functions listed per endpoint in the report.
+
+# Datastore RPC instrumentation, every request's RPCs are in its Server-Timing header and the totals at
+# /admin/datastore/rpcs. In debug mode requests making more RPCs than their endpoint's budget log a warning, the
+# DATASTORE_RPC_DEBUG environment variable set to 1 turns it on, e.g. in CI.
+DATASTORE_RPC_DEBUG = False
+DATASTORE_RPC_BUDGET = 8 # RPCs per request.
+DATASTORE_RPC_BUDGETS = {"airplanes.get_airplanes": 4, "cargo.get_cargos": 4} # Budgets of specific endpoints.
+
+# Metrics served at /metrics. With several worker processes set METRICS_DIR, or the environment variable, to a directory
+# they share and empty it when the server starts, each process writes its values there every METRICS_FLUSH_INTERVAL
+# seconds and /metrics sums them.
+METRICS_DIR = None
+METRICS_FLUSH_INTERVAL = 5 # Seconds.
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Seconds.
+METRICS_RPC_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0) # Seconds.
+
+# Production server settings used by serving.py. Workers default to one per CPU and threads per worker to
+# 1 / (1 - SERVING_IO_WAIT), the share of request time spent waiting on Datastore and the identity provider, measured
+# with benchmarks/bench_serving.py. The SERVING_IO_WAIT, WEB_CONCURRENCY and SERVING_THREADS environment variables
+# override them.
+SERVING_IO_WAIT = 0.75
+SERVING_MAX_THREADS = 32
+SERVING_TIMEOUT = 60 # Seconds before a stuck worker is restarted.
+SERVING_GRACEFUL_TIMEOUT = 20 # Seconds workers get to finish their requests on shutdown.
+
+# Async serving mode, asgi.py. The event loop handles every connection, blocking Datastore RPCs and sync views run on
+# a pool of this many threads, the ASYNC_THREADS environment variable overrides it. ASYNC_STREAM_CHUNK_SIZE is how many
+# bytes of a streamed body are gathered in the thread producing it before being handed to the event loop.
+ASYNC_THREADS = 16
+ASYNC_STREAM_CHUNK_SIZE = 64 * 1024
@@ -0,0 +1,55 @@
+from flask import Blueprint, request, jsonify
+import helpers.counter_helpers as counter_helpers
+import helpers.client_helpers as client_helpers
+import helpers.profile_helpers as profile_helpers
+import helpers.rpc_helpers as rpc_helpers
+from helpers.controler_helpers import is_cron_request, is_admin_request
+from constants import PROFILE_TOP_FUNCTIONS
+
+admin_bp = Blueprint("admin", __name__)
+
+# Maintenance routes, only callable by App Engine cron (see cron.yaml) unless noted.
+# Route and function to recount airplanes and cargo and repair counters that drifted.
+@admin_bp.route("/admin/counters/reconcile", methods=["GET"])
+def reconcile_counters():
+    if not is_cron_request(request): # If not sent by cron.
+        return jsonify({"Error": "Forbidden"}), 403
+    
+    report = {
+        "Airplane": counter_helpers.reconcile(client_helpers.client, "Airplane", per_pilot=True),
+        "Cargo": counter_helpers.reconcile(client_helpers.client, "Cargo", per_pilot=False),
+    }
+    return jsonify(report), 200
+
+# Route and function to view the request profiles merged per endpoint, admins only.
+@admin_bp.route("/admin/profiles", methods=["GET"])
+def get_profiles():
+    if not is_admin_request(request): # If not an admin.
+        return jsonify({"Error": "Forbidden"}), 403
+    
+    sort = request.args.get("sort", "own")
+    if sort not in ("own", "cumulative"): # If unknown sort.
+        return jsonify({"Error": "sort must be own or cumulative"}), 400
+    try:
+        limit = int(request.args.get("limit", PROFILE_TOP_FUNCTIONS))
+    except ValueError: # If limit not a number.
+        return jsonify({"Error": "limit must be a number"}), 400
+    
+    return jsonify(profile_helpers.get_report(request.args.get("endpoint"), sort, limit)), 200
+
+# Route and function to drop the collected profiles, admins only.
+@admin_bp.route("/admin/profiles", methods=["DELETE"])
+def delete_profiles():
+    if not is_admin_request(request): # If not an admin.
+        return jsonify({"Error": "Forbidden"}), 403
+    
+    profile_helpers.reset()
+    return "", 204
+
+# Route and function to view the Datastore RPC totals per operation and per endpoint, admins only.
+@admin_bp.route("/admin/datastore/rpcs", methods=["GET"])
+def get_datastore_rpcs():
+    if not is_admin_request(request): # If not an admin.
+        return jsonify({"Error": "Forbidden"}), 403
+    
+    return jsonify(rpc_helpers.get_stats()), 200
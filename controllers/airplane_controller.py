@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 import models.airplane_model as airplane_model
-from helpers.controler_helpers import verify_jwt, json_response_type
+import helpers.cursor_helpers as cursor_helpers
+import helpers.stream_helpers as stream_helpers
+from helpers.controler_helpers import verify_jwt, json_response_type, batch_status, expected_etags, not_modified, OFFSET_WARNING
+from helpers.model_helpers import entity_etag
+from constants import BATCH_CREATE_LIMIT
 
 airplane_bp = Blueprint("airplanes", __name__)
 
@@ -24,6 +28,35 @@ def create_airplane():
     
     return jsonify(new_airplane), code # new_airplane and code 201 if successful.
 
+# Create many airplanes at once.
+@airplane_bp.route("/airplanes:batch", methods=["POST"])
+def batch_create_airplanes():
+    if not json_response_type(request): # If response type not json.
+        return jsonify({"Error": "Unsupported response type"}), 406
+    
+    payload = verify_jwt(request)
+    if "Error" in payload: # If invalid JWT or JWT missing, return error and code 401.
+        return jsonify(payload), 401
+    
+    content = request.get_json()
+    if not isinstance(content, list) or not content or len(content) > BATCH_CREATE_LIMIT: # If not a list or too long.
+        return jsonify({"Error": f"The request must be a list of 1 to {BATCH_CREATE_LIMIT} airplane objects"}), 400
+    
+    results, valid = [], []
+    for index, attributes in enumerate(content):
+        if not isinstance(attributes, dict) or set(attributes.keys()) != {"tail_number", "type", "capacity"}: # Verify correct attributes sent.
+            results.append({"Error": "Missing attribute/s or too many attributes"})
+        else:
+            results.append(None)
+            valid.append((index, (attributes["tail_number"], attributes["type"], attributes["capacity"])))
+    
+    base_url = request.base_url.replace(":batch", "")
+    new_airplanes = airplane_model.create_airplanes(base_url, [airplane for _, airplane in valid], payload["sub"])
+    for (index, _), new_airplane in zip(valid, new_airplanes):
+        results[index] = {"id": new_airplane["id"], "self": new_airplane["self"]}
+    
+    return jsonify(results), batch_status(len(valid), len(content))
+
 # Get an airplane.
 @airplane_bp.route("/airplanes/<airplane_id>", methods=["GET"])
 def get_airplane(airplane_id):
@@ -38,12 +71,17 @@ def get_airplane(airplane_id):
     if not success: # If airplane not found code 404 or wrong pilot/user trying to access code 401.
         return jsonify(airplane), code
     
-    return jsonify(airplane), code # If airplane found send airplane and code 200.
+    etag = entity_etag(airplane)
+    if not_modified(request, etag): # Client already has this version, skip the body.
+        return "", 304, {"ETag": etag}
+    
+    return jsonify(airplane), code, {"ETag": etag} # If airplane found send airplane and code 200.
 
 # Get all user airplanes.
 @airplane_bp.route("/airplanes", methods=["GET"])
 def get_airplanes():
-    if not json_response_type(request): # If response type not json.
+    response_type = stream_helpers.list_response_type(request)
+    if not response_type: # If response type not json or ndjson.
         return jsonify({"Error": "Unsupported response type"}), 406
     
     payload = verify_jwt(request)
@@ -52,9 +90,20 @@ def get_airplanes():
     
     q_limit = request.args.get("limit", "5")
     q_offset = request.args.get("offset", "0")
-    airplanes = airplane_model.get_airplanes(request.base_url, q_limit, q_offset, payload["sub"])
-    
-    return jsonify(airplanes), 200
+    q_cursor = request.args.get("cursor")
+    cursor = None
+    if q_cursor: # Cursor from a previous next url, takes precedence over offset.
+        cursor = cursor_helpers.decode_cursor(q_cursor, cursor_helpers.scope("Airplane", payload["sub"]))
+        if cursor is None:
+            return jsonify({"Error": "Invalid cursor"}), 400
+    
+    airplanes, envelope = airplane_model.list_airplanes(request.base_url, q_limit, q_offset, payload["sub"], cursor)
+    total = airplane_model.count_airplanes(payload["sub"]) # Counted before the 200 is sent so errors still surface.
+    response = stream_helpers.stream_list(response_type, "airplanes", airplanes, lambda: envelope(total))
+    if not cursor and q_offset != "0": # Offset still works but gets slower with depth.
+        response.headers["Warning"] = OFFSET_WARNING
+    
+    return response, 200
 
 # Route and function to edit subset of airplane attributes.
 @airplane_bp.route("/airplanes/<airplane_id>", methods=["PATCH"])
@@ -69,8 +118,11 @@ def patch_airplane(airplane_id):
     content = request.get_json()
     tail_number, type, capacity = content.get("tail_number"), content.get("type"), content.get("capacity")
     cargo, code = airplane_model.update_airplane(request.base_url, "PATCH", airplane_id, payload["sub"],
-                                                 {"tail_number": tail_number, "type": type, "capacity": capacity})
-    return jsonify(cargo), code # Code 200 and airplane if success 404 or 401 along with error message if error.
+                                                 {"tail_number": tail_number, "type": type, "capacity": capacity},
+                                                 expected_etags(request))
+    if code >= 400: # Code 404, 401 or 412 if airplane changed since the If-Match ETag, along with error message.
+        return jsonify(cargo), code
+    return jsonify(cargo), code, {"ETag": entity_etag(cargo)} # Code 200 and airplane if success.
 
 # Route and function to edit all airplane attributes.
 @airplane_bp.route("/airplanes/<airplane_id>", methods=["PUT"])
@@ -88,8 +140,11 @@ def put_airplane(airplane_id):
     
     tail_number, type, capacity = content.get("tail_number"), content.get("type"), content.get("capacity")
     cargo, code = airplane_model.update_airplane(request.base_url, "PUT", airplane_id, payload["sub"],
-                                                 {"tail_number": tail_number, "type": type, "capacity": capacity})
-    return jsonify(cargo), code # Code 303 and airplane if success 404 or 401 along with error message if error.
+                                                 {"tail_number": tail_number, "type": type, "capacity": capacity},
+                                                 expected_etags(request))
+    if code >= 400: # Code 404, 401 or 412 if airplane changed since the If-Match ETag, along with error message.
+        return jsonify(cargo), code
+    return jsonify(cargo), code, {"ETag": entity_etag(cargo)} # Code 303 and airplane if success.
 
 # Delete airplane of passed user.
 @airplane_bp.route("/airplanes/<airplane_id>", methods=["DELETE"])
@@ -0,0 +1,68 @@
+import asyncio
+from flask import request, jsonify
+import models.airplane_model as airplane_model
+import models.cargo_model as cargo_model
+import helpers.cursor_helpers as cursor_helpers
+import helpers.stream_helpers as stream_helpers
+from helpers.controler_helpers import verify_jwt, prefetch_jwks, OFFSET_WARNING
+
+# Native async versions of the routes whose RPCs don't depend on each other, served by asgi.py in place of the sync
+# views. Same responses as the sync views, but the page query and the count run at the same time in the thread pool.
+# Every other route runs its sync view in the thread pool as is, assign_cargo for one already reads the cargo and the
+# airplane in a single get_multi.
+
+# Get all airplanes of the user, the page and the total are read concurrently.
+async def get_airplanes():
+    response_type = stream_helpers.list_response_type(request)
+    if not response_type: # If response type not json or ndjson.
+        return jsonify({"Error": "Unsupported response type"}), 406
+    
+    await prefetch_jwks(request)
+    payload = await asyncio.to_thread(verify_jwt, request) # Refetches the JWKS itself if the prefetch failed.
+    if "Error" in payload: # If invalid JWT or JWT missing, return error and code 401.
+        return jsonify(payload), 401
+    
+    q_limit = request.args.get("limit", "5")
+    q_offset = request.args.get("offset", "0")
+    q_cursor = request.args.get("cursor")
+    cursor = None
+    if q_cursor: # Cursor from a previous next url, takes precedence over offset.
+        cursor = cursor_helpers.decode_cursor(q_cursor, cursor_helpers.scope("Airplane", payload["sub"]))
+        if cursor is None:
+            return jsonify({"Error": "Invalid cursor"}), 400
+    
+    (airplanes, envelope), total = await asyncio.gather(
+        asyncio.to_thread(airplane_model.list_airplanes, request.base_url, q_limit, q_offset, payload["sub"], cursor),
+        asyncio.to_thread(airplane_model.count_airplanes, payload["sub"]))
+    response = stream_helpers.render_list(response_type, "airplanes", airplanes, lambda: envelope(total))
+    if not cursor and q_offset != "0": # Offset still works but gets slower with depth.
+        response.headers["Warning"] = OFFSET_WARNING
+    
+    return response, 200
+
+# Get all loads, the page and the total are read concurrently.
+async def get_cargos():
+    response_type = stream_helpers.list_response_type(request)
+    if not response_type: # If response type not json or ndjson.
+        return jsonify({"Error": "Unsupported response type"}), 406
+    
+    q_limit = request.args.get("limit", "5")
+    q_offset = request.args.get("offset", "0")
+    q_cursor = request.args.get("cursor")
+    cursor = None
+    if q_cursor: # Cursor from a previous next url, takes precedence over offset.
+        cursor = cursor_helpers.decode_cursor(q_cursor, cursor_helpers.scope("Cargo", None))
+        if cursor is None:
+            return jsonify({"Error": "Invalid cursor"}), 400
+    
+    (loads, envelope), total = await asyncio.gather(
+        asyncio.to_thread(cargo_model.list_cargos, request.base_url, q_limit, q_offset, cursor),
+        asyncio.to_thread(cargo_model.count_cargos))
+    response = stream_helpers.render_list(response_type, "Cargos", loads, lambda: envelope(total))
+    if not cursor and q_offset != "0": # Offset still works but gets slower with depth.
+        response.headers["Warning"] = OFFSET_WARNING
+    
+    return response, 200
+
+# Endpoint of the sync view to the async view replacing it.
+ASYNC_VIEWS = {"airplanes.get_airplanes": get_airplanes, "cargo.get_cargos": get_cargos}
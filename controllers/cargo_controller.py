@@ -1,6 +1,10 @@
 from flask import Blueprint, request, jsonify
 import models.cargo_model as cargo_model
-from helpers.controler_helpers import json_response_type
+import helpers.cursor_helpers as cursor_helpers
+import helpers.stream_helpers as stream_helpers
+from helpers.controler_helpers import json_response_type, batch_status, expected_etags, not_modified, OFFSET_WARNING
+from helpers.model_helpers import entity_etag
+from constants import BATCH_ASSIGN_LIMIT, BATCH_CREATE_LIMIT
 
 cargo_bp = Blueprint("cargo", __name__)
 
@@ -19,6 +23,31 @@ def create_cargo():
     new_cargo = cargo_model.create_cargo(request.base_url, weight, item)
     return jsonify(new_cargo), 201 # If succes.
 
+# Route and function to create many cargo entities at once.
+@cargo_bp.route("/cargo:batch", methods=["POST"])
+def batch_create_cargo():
+    if not json_response_type(request): # If response type not json.
+        return jsonify({"Error": "Unsupported response type"}), 406
+    
+    content = request.get_json()
+    if not isinstance(content, list) or not content or len(content) > BATCH_CREATE_LIMIT: # If not a list or too long.
+        return jsonify({"Error": f"The request must be a list of 1 to {BATCH_CREATE_LIMIT} cargo objects"}), 400
+    
+    results, valid = [], []
+    for index, attributes in enumerate(content):
+        weight, item = (attributes.get("weight"), attributes.get("item")) if isinstance(attributes, dict) else (None, None)
+        if not all([weight, item]): # If attribute missing.
+            results.append({"Error": "The request object is missing at least one of the required attributes"})
+        else:
+            results.append(None)
+            valid.append((index, (weight, item)))
+    
+    new_cargos = cargo_model.create_cargos(request.base_url.replace(":batch", ""), [cargo for _, cargo in valid])
+    for (index, _), new_cargo in zip(valid, new_cargos):
+        results[index] = {"id": new_cargo["id"], "self": new_cargo["self"]}
+    
+    return jsonify(results), batch_status(len(valid), len(content))
+
 # Route and function to view a cargo entity.
 @cargo_bp.route("/cargo/<cargo_id>", methods=["GET"])
 def get_cargo(cargo_id):
@@ -28,19 +57,35 @@ def get_cargo(cargo_id):
     cargo = cargo_model.get_cargo(request.base_url, cargo_id)
     if not cargo: # If cargo not found.
         return jsonify({"Error": "No cargo with this cargo_id exists"}), 404
-    return jsonify(cargo), 200 # If succes.
+    
+    etag = entity_etag(cargo)
+    if not_modified(request, etag): # Client already has this version, skip the body.
+        return "", 304, {"ETag": etag}
+    return jsonify(cargo), 200, {"ETag": etag} # If succes.
 
 # Route and function to view all cargo entities.
 @cargo_bp.route("/cargo", methods=["GET"])
 def get_cargos():
-    if not json_response_type(request): # If response type not json.
+    response_type = stream_helpers.list_response_type(request)
+    if not response_type: # If response type not json or ndjson.
         return jsonify({"Error": "Unsupported response type"}), 406
     
     q_limit = request.args.get("limit", "5")
     q_offset = request.args.get("offset", "0")
-    loads = cargo_model.get_cargos(request.base_url, q_limit, q_offset)
+    q_cursor = request.args.get("cursor")
+    cursor = None
+    if q_cursor: # Cursor from a previous next url, takes precedence over offset.
+        cursor = cursor_helpers.decode_cursor(q_cursor, cursor_helpers.scope("Cargo", None))
+        if cursor is None:
+            return jsonify({"Error": "Invalid cursor"}), 400
     
-    return jsonify(loads), 200 # Success code.
+    loads, envelope = cargo_model.list_cargos(request.base_url, q_limit, q_offset, cursor)
+    total = cargo_model.count_cargos() # Read before streaming starts, a failure is then an error response.
+    response = stream_helpers.stream_list(response_type, "Cargos", loads, lambda: envelope(total))
+    if not cursor and q_offset != "0": # Offset still works but gets slower with depth.
+        response.headers["Warning"] = OFFSET_WARNING
+    
+    return response, 200 # Success code.
 
 # Route and function to edit subset of cargo attributes.
 @cargo_bp.route("/cargo/<cargo_id>", methods=["PATCH"])
@@ -50,9 +95,12 @@ def patch_cargo(cargo_id):
     
     content = request.get_json()
     weight, item = content.get("weight"), content.get("item")
-    cargo, code = cargo_model.update_cargo(request.base_url, "PATCH", cargo_id, {"weight": weight, "item": item})
+    cargo, code = cargo_model.update_cargo(request.base_url, "PATCH", cargo_id, {"weight": weight, "item": item},
+                                           expected_etags(request))
+    if code >= 400: # Code 404, or 412 if cargo changed since the If-Match ETag, along with error message.
+        return jsonify(cargo), code
     
-    return jsonify(cargo), code # Code 200 and load if success 404 along with error message if load_id not found.
+    return jsonify(cargo), code, {"ETag": entity_etag(cargo)} # Code 200 and load if success.
 
 # Route and function to edit all cargo attributes.
 @cargo_bp.route("/cargo/<cargo_id>", methods=["PUT"])
@@ -65,9 +113,12 @@ def put_cargo(cargo_id):
         return jsonify({"Error": "Missing attribute/s or too many attributes"}), 400
     
     weight, item = content.get("weight"), content.get("item")
-    cargo, code = cargo_model.update_cargo(request.base_url, "PUT", cargo_id, {"weight": weight, "item": item})
+    cargo, code = cargo_model.update_cargo(request.base_url, "PUT", cargo_id, {"weight": weight, "item": item},
+                                           expected_etags(request))
+    if code >= 400: # Code 404, or 412 if cargo changed since the If-Match ETag, along with error message.
+        return jsonify(cargo), code
     
-    return jsonify(cargo), code # Code 303 and load if success 404 along with error message if load_id not found.
+    return jsonify(cargo), code, {"ETag": entity_etag(cargo)} # Code 303 and load if success.
 
 # Route and function to delete a cargo entity.
 @cargo_bp.route("/cargo/<cargo_id>", methods=["DELETE"])
@@ -92,6 +143,38 @@ def assign_cargo(airplane_id, cargo_id):
     
     return "", 204 # If success.
 
+# Route and function to assign a list of cargo to an airplane in one transaction.
+@cargo_bp.route("/airplanes/<airplane_id>/cargo:batchAssign", methods=["POST"])
+def batch_assign_cargo(airplane_id):
+    if not json_response_type(request): # If response type not json.
+        return jsonify({"Error": "Unsupported response type"}), 406
+    
+    content = request.get_json()
+    ids_error = {"Error": f"cargo_ids must be a list of 1 to {BATCH_ASSIGN_LIMIT} cargo ids"}
+    if not isinstance(content, dict): # If body is a list, string or null instead of an object.
+        return jsonify(ids_error), 400
+    cargo_ids, mode = content.get("cargo_ids"), content.get("mode", "all_or_nothing")
+    if not isinstance(cargo_ids, list) or not cargo_ids or len(cargo_ids) > BATCH_ASSIGN_LIMIT: # If ids missing or too many.
+        return jsonify(ids_error), 400
+    if mode not in ("all_or_nothing", "best_effort"): # If unknown mode.
+        return jsonify({"Error": "mode must be all_or_nothing or best_effort"}), 400
+    try:
+        cargo_ids = list(dict.fromkeys(int(cargo_id) for cargo_id in cargo_ids)) # Drop duplicates, keep order.
+    except (TypeError, ValueError): # If an id isn't a number.
+        return jsonify(ids_error), 400
+    
+    found, committed, results = cargo_model.assign_cargos(airplane_id, cargo_ids, mode == "best_effort")
+    if not found: # If no airplane found.
+        return jsonify({"Error": "The specified airplane does not exist"}), 404
+    
+    assigned = sum(1 for result in results if result["status"] == "assigned") if committed else 0
+    response = {"assigned": assigned, "results": results}
+    if not committed and mode == "all_or_nothing": # If any cargo could not be assigned nothing was.
+        response["Error"] = "Not every cargo could be assigned, none were"
+        return jsonify(response), 403
+    
+    return jsonify(response), 200 # If success.
+
 # Route and function to remove cargo from an airplane.
 @cargo_bp.route("/airplanes/<airplane_id>/cargo/<cargo_id>", methods={"DELETE"})
 def remove_cargo(airplane_id, cargo_id):
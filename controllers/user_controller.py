@@ -1,13 +1,41 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 import models.user_model as user_model
+import helpers.cursor_helpers as cursor_helpers
+from helpers.controler_helpers import is_admin_request
+from constants import USERS_PAGE_SIZE, USERS_LIMIT_MAX
 
 user_bp = Blueprint("users", __name__)
 
 # Route and function to view all users.
 @user_bp.route("/users", methods=["GET"])
 def get_users():
-    users = user_model.get_users()
-    return jsonify(users), 200  # Return all boats in a list with 200 code.
+    q_limit = request.args.get("limit", str(USERS_PAGE_SIZE))
+    if not q_limit.isdigit() or int(q_limit) == 0: # If limit not a positive number.
+        return jsonify({"Error": "limit must be a positive number"}), 400
+    q_limit = str(min(int(q_limit), USERS_LIMIT_MAX)) # Cap the page size.
+    
+    keys_only = request.args.get("keys_only") == "true"
+    q_cursor = request.args.get("cursor")
+    cursor = None
+    if q_cursor: # Cursor from a previous next url of the same kind of listing.
+        cursor = cursor_helpers.decode_cursor(q_cursor, user_model.cursor_scope(keys_only))
+        if cursor is None:
+            return jsonify({"Error": "Invalid cursor"}), 400
+    
+    users = user_model.get_users(request.base_url, q_limit, cursor, keys_only)
+    return jsonify(users), 200  # Return a page of users with 200 code.
+
+# Route and function to export every user as newline delimited JSON, admin only.
+@user_bp.route("/users:export", methods=["GET"])
+def export_users():
+    if not is_admin_request(request): # If not an admin.
+        return jsonify({"Error": "Forbidden"}), 403
+    
+    def generate(): # One JSON document per line, written as the users are fetched.
+        for user in user_model.export_users():
+            yield current_app.json.dumps(user) + "\n"
+    
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
 
 # Methods not supported for /users.
 @user_bp.route("/users", methods=["POST","PATCH", "PUT","DELETE"])
@@ -0,0 +1,100 @@
+import asyncio
+import contextvars
+import io
+import sys
+import threading
+from constants import ASYNC_STREAM_CHUNK_SIZE
+
+# Translation between ASGI and the WSGI environ and responses Flask works with, used by asgi.py. Bodies Flask already
+# holds in memory are sent as they are, streamed bodies are iterated in a thread since producing them may make RPCs.
+
+_END = object() # Marks the end of a streamed body.
+
+async def read_body(receive: object) -> bytes:
+    """Returns the whole request body."""
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return bytes(body)
+
+def build_environ(scope: dict, body: bytes) -> dict:
+    """Returns the WSGI environ of an ASGI http scope and its body."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"), # WSGI strings are bytes decoded as latin-1.
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "REMOTE_ADDR": client[0],
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope["headers"]:
+        name = name.decode("latin-1")
+        if name in ("content-type", "content-length"):
+            key = name.upper().replace("-", "_")
+        else:
+            key = "HTTP_" + name.upper().replace("-", "_")
+        value = value.decode("latin-1")
+        environ[key] = environ[key] + "," + value if key in environ else value # Repeated headers are joined.
+    return environ
+
+async def send_response(send: object, status: str, headers: list, body: object, streamed: bool,
+                        context: contextvars.Context = None):
+    """Sends a WSGI status, headers and body iterable. A streamed body is iterated in a thread and sent in chunks of
+    up to ASYNC_STREAM_CHUNK_SIZE bytes, otherwise it's joined and sent at once. context is the one the body was
+    created in, a generator that set context variables must reset them in the same context."""
+    await send({"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]})
+    if not streamed:
+        try:
+            await send({"type": "http.response.body", "body": b"".join(body)})
+        finally:
+            getattr(body, "close", lambda: None)()
+        return
+    
+    loop = asyncio.get_running_loop()
+    chunks = asyncio.Queue(maxsize=2) # Bounded so a slow client holds the producing thread back.
+    stopped = threading.Event()
+    
+    def produce():
+        try:
+            pending, size = [], 0
+            for chunk in body:
+                if stopped.is_set(): # The client went away.
+                    return
+                pending.append(chunk)
+                size += len(chunk)
+                if size >= ASYNC_STREAM_CHUNK_SIZE:
+                    asyncio.run_coroutine_threadsafe(chunks.put(b"".join(pending)), loop).result()
+                    pending, size = [], 0
+            if pending:
+                asyncio.run_coroutine_threadsafe(chunks.put(b"".join(pending)), loop).result()
+        finally:
+            getattr(body, "close", lambda: None)()
+            asyncio.run_coroutine_threadsafe(chunks.put(_END), loop).result()
+    
+    producer = loop.run_in_executor(None, (context or contextvars.copy_context()).run, produce)
+    try:
+        while (chunk := await chunks.get()) is not _END:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await producer # Raises the producer's error, the body is then cut short instead of ending cleanly.
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        stopped.set()
+        while not producer.done(): # Unblock the producer if it's waiting on a full queue.
+            while not chunks.empty():
+                chunks.get_nowait()
+            await asyncio.sleep(0.01)
+        producer.cancelled() or producer.exception() # Retrieved, so it isn't logged as unhandled.
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Thread safe LRU cache bounded by maxsize where every entry carries its own expiry time."""
+
+    def __init__(self, maxsize: int, clock=time.time):
+        self.maxsize = maxsize
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value stored under key, or default if it's missing or expired."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= self.clock(): # Expired, drop it.
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key) # Mark as most recently used.
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at: float):
+        """Stores value under key until expires_at, evicting the least recently used entry if full."""
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        """Removes key from the cache if present."""
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry."""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Returns hit, miss and size counters."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data), "maxsize": self.maxsize}
+
+class LocalBackend:
+    """Versioned cache backend kept in this process. Values are (version, data) and a value only replaces one with a
+    lower version, so a slow reader can't put back data older than what a writer stored."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.ttl = ttl
+        self._cache = TTLCache(maxsize)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple:
+        """Returns (version, data) stored under key, or None."""
+        return self._cache.get(key)
+
+    def set_if_newer(self, key: str, version: int, data: bytes) -> bool:
+        """Stores data under key unless the cached version is the same or newer. Returns True if stored."""
+        with self._lock:
+            current = self._cache.get(key)
+            if current is not None and current[0] >= version:
+                return False
+            self._cache.set(key, (version, data), time.time() + self.ttl)
+            return True
+
+class RedisBackend:
+    """Versioned cache backend in Redis, shared by every worker process on the host. Same semantics as LocalBackend,
+    the version check runs server side in a script so it's atomic across processes."""
+
+    SET_IF_NEWER = """
+    local current = redis.call('HGET', KEYS[1], 'v')
+    if current and tonumber(current) >= tonumber(ARGV[1]) then return 0 end
+    redis.call('HSET', KEYS[1], 'v', ARGV[1], 'd', ARGV[2])
+    redis.call('PEXPIRE', KEYS[1], ARGV[3])
+    return 1
+    """
+
+    def __init__(self, url: str, ttl: float):
+        import redis # Optional dependency, only needed for this backend.
+        self.ttl = ttl
+        self._redis = redis.Redis.from_url(url)
+        self._set_if_newer = self._redis.register_script(self.SET_IF_NEWER)
+
+    def get(self, key: str) -> tuple:
+        """Returns (version, data) stored under key, or None."""
+        version, data = self._redis.hmget(key, "v", "d")
+        if version is None:
+            return None
+        return int(version), data or None # Empty data marks a deleted entity.
+
+    def set_if_newer(self, key: str, version: int, data: bytes) -> bool:
+        """Stores data under key unless the cached version is the same or newer. Returns True if stored."""
+        return bool(self._set_if_newer(keys=[key], args=[version, data or b"", int(self.ttl * 1000)]))
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+from urllib.parse import urlparse
+from helpers.import_helpers import lazy_import
+from helpers.rpc_helpers import InstrumentedClient
+from constants import DATASTORE_BACKEND, DATASTORE_EMULATOR_HOST, DATASTORE_MEMORY_LATENCY, GRPC_CHANNEL_OPTIONS
+
+datastore = lazy_import("google.cloud.datastore")
+
+# One Datastore client per process shared by every model, built on first use.
+_client = None
+_lock = threading.Lock()
+
+def _backend() -> str:
+    """Returns the configured backend, the DATASTORE_BACKEND environment variable overrides constants.py."""
+    return os.environ.get("DATASTORE_BACKEND", DATASTORE_BACKEND)
+
+def _make_datastore_api(client: object) -> object:
+    """Returns the GAPIC Datastore API of client over a gRPC channel tuned with GRPC_CHANNEL_OPTIONS."""
+    from google.cloud.datastore_v1.services.datastore import client as datastore_client
+    from google.cloud.datastore_v1.services.datastore.transports import grpc as datastore_grpc
+
+    host = urlparse(client.base_url).netloc
+    channel = datastore_grpc.DatastoreGrpcTransport.create_channel(host, credentials=client._credentials,
+                                                                   options=list(GRPC_CHANNEL_OPTIONS.items()))
+    transport = datastore_grpc.DatastoreGrpcTransport(channel=channel)
+    return datastore_client.DatastoreClient(transport=transport, client_info=client._client_info)
+
+def _make_client() -> object:
+    """Builds the client for the configured backend, "cloud", "emulator" or "memory"."""
+    backend = _backend()
+    if backend == "memory":
+        from helpers.memory_helpers import MemoryClient
+        latency = float(os.environ.get("DATASTORE_MEMORY_LATENCY", DATASTORE_MEMORY_LATENCY))
+        return MemoryClient(project=os.environ.get("DATASTORE_PROJECT_ID", "local"), latency=latency)
+    if backend == "emulator":
+        os.environ.setdefault("DATASTORE_EMULATOR_HOST", DATASTORE_EMULATOR_HOST)
+        return datastore.Client(project=os.environ.get("DATASTORE_PROJECT_ID", "local")) # Emulator uses its own channel.
+    if backend != "cloud":
+        raise ValueError(f"Unknown DATASTORE_BACKEND {backend}")
+
+    client = datastore.Client()
+    if client._use_grpc: # Replace the default channel before the first RPC opens it.
+        client._datastore_api_internal = _make_datastore_api(client)
+    return client
+
+def get_client() -> object:
+    """Returns the shared Datastore client, building it the first time it's needed. Its RPCs are recorded by
+    rpc_helpers."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None: # Another thread may have built it while we waited.
+                _client = InstrumentedClient(_make_client())
+    return _client
+
+def health_check() -> dict:
+    """Looks up a key that doesn't exist, which opens the channel and fetches credentials without reading data.
+    Returns the status and latency of the lookup."""
+    start = time.perf_counter()
+    try:
+        client = get_client()
+        client.get(client.key("HealthCheck", "ping"))
+    except Exception as e:
+        return {"datastore": "error", "Error": str(e)}
+    return {"datastore": "ok", "latency_ms": round((time.perf_counter() - start) * 1000, 2)}
+
+def reset():
+    """Drops the shared client so the next use builds a new one. Called in forked workers, the gRPC channel of the
+    parent's client can't be used after a fork."""
+    global _client, _lock
+    _client = None
+    _lock = threading.Lock() # May have been held by another thread of the parent.
+
+def warm_up():
+    """Runs the health check in a background thread so the channel is ready before the first request."""
+    thread = threading.Thread(target=health_check, daemon=True)
+    thread.start()
+
+class _SharedClient:
+    """Stands in for the shared client so models can bind it at import time, every attribute is looked up on the
+    real client which is only built on first use."""
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+client = _SharedClient()
@@ -1,7 +1,13 @@
-from jose import jwt
-from constants import ALGORITHMS, CLIENT_ID, DOMAIN
-import json
-from urllib.request import urlopen
+from helpers.import_helpers import lazy_import
+from constants import ALGORITHMS, CLIENT_ID, DOMAIN, ADMIN_SUBS
+import helpers.jwks_helpers as jwks_helpers
+import helpers.token_helpers as token_helpers
+import helpers.metrics_helpers as metrics_helpers
+
+jwt = lazy_import("jose.jwt")
+
+# Sent with pages requested by offset, clients should follow the cursor in next instead.
+OFFSET_WARNING = '299 - "offset pagination is deprecated and slow, use the cursor from next"'
 
 def json_response_type(request:object) -> bool:
     """Receives a request object and returns True if response type is application/json otherwise returns False."""
@@ -9,6 +15,33 @@ def json_response_type(request:object) -> bool:
         return False
     return True
 
+def batch_status(created: int, requested: int) -> int:
+    """Returns the status code of a batch create, 201 if every item was created, 400 if none and 207 if some."""
+    if created == requested:
+        return 201
+    return 400 if created == 0 else 207
+
+def expected_etags(request:object) -> set:
+    """Returns the ETags of the request's If-Match header for strong comparison, or None if any version is accepted."""
+    if not request.headers.get("If-Match") or request.if_match.star_tag:
+        return None
+    return {'"' + etag + '"' for etag in request.if_match.as_set()} # Weak tags never match strongly.
+
+def not_modified(request:object, etag: str) -> bool:
+    """Returns True if the request's If-None-Match header matches etag, so a 304 can be sent instead of the body."""
+    return request.if_none_match.contains_weak(etag.strip('"'))
+
+def is_cron_request(request:object) -> bool:
+    """Returns True if the request was sent by App Engine cron. App Engine strips this header from external requests."""
+    return request.headers.get("X-Appengine-Cron") == "true"
+
+def is_admin_request(request:object) -> bool:
+    """Returns True for App Engine cron requests and for requests with a valid JWT whose sub is in ADMIN_SUBS."""
+    if is_cron_request(request):
+        return True
+    payload = verify_jwt(request)
+    return "Error" not in payload and payload.get("sub") in ADMIN_SUBS
+
 # This code is adapted from https://auth0.com/docs/quickstart/backend/python/01-authorization?_ga=2.46956069.349333901.1589042886-466012638.1589042885#create-the-jwt-validation-decorator
 # Verify the JWT in the request's Authorization header
 def verify_jwt(request):
@@ -16,10 +49,40 @@ def verify_jwt(request):
         auth_header = request.headers['Authorization'].split()
         token = auth_header[1]
     else:
+        _count_verification({"Error": "Authorization header is missing"}, False)
         return {"Error": "Authorization header is missing"}
     
-    jsonurl = urlopen("https://"+ DOMAIN+"/.well-known/jwks.json")
-    jwks = json.loads(jsonurl.read())
+    token_key = token_helpers.token_hash(token)
+    cached = token_helpers.get_cached(token_key)
+    if cached is not None: # Token already verified or rejected, skip decoding.
+        _count_verification(cached, True)
+        return cached
+    
+    result = decode_jwt(token)
+    token_helpers.cache_result(token_key, result)
+    _count_verification(result, False)
+    return result
+
+def _count_verification(result: dict, cached: bool):
+    """Counts a verify_jwt outcome, "valid" or its error, e.g. "token_expired"."""
+    outcome = result["Error"].lower().replace(" ", "_") if "Error" in result else "valid"
+    metrics_helpers.inc("jwt_verifications_total", (("outcome", outcome), ("cached", "true" if cached else "false")))
+
+async def prefetch_jwks(request) -> None:
+    """Awaits the JWKS fetch verify_jwt would block on for the request's token, if any, in async handlers."""
+    if 'Authorization' not in request.headers:
+        return
+    token = request.headers['Authorization'].split()[-1]
+    if token_helpers.get_cached(token_helpers.token_hash(token)) is not None: # Verified before, no key needed.
+        return
+    try:
+        kid = jwt.get_unverified_header(token).get("kid")
+    except jwt.JWTError:
+        return
+    await jwks_helpers.prefetch(kid)
+
+def decode_jwt(token: str) -> dict:
+    """Receives a bearer token and verifies its RS256 signature and claims. Returns the payload or an error dict."""
     try:
         unverified_header = jwt.get_unverified_header(token)
     except jwt.JWTError:
@@ -27,16 +90,7 @@ def verify_jwt(request):
     if unverified_header["alg"] == "HS256":
         return {"Error": "Invalid header"}
     
-    rsa_key = {}
-    for key in jwks["keys"]:
-        if key["kid"] == unverified_header["kid"]:
-            rsa_key = {
-                "kty": key["kty"],
-                "kid": key["kid"],
-                "use": key["use"],
-                "n": key["n"],
-                "e": key["e"]
-            }
+    rsa_key = jwks_helpers.get_signing_key(unverified_header.get("kid")) # Cached JWKS lookup by kid.
     if rsa_key:
         try:
             payload = jwt.decode(
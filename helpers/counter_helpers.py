@@ -0,0 +1,120 @@
+import random
+from collections import Counter
+from helpers.import_helpers import lazy_import
+import helpers.model_helpers as model_helpers
+from constants import COUNTER_SHARDS, DATASTORE_MAX_BATCH
+
+datastore = lazy_import("google.cloud.datastore")
+exceptions = lazy_import("google.api_core.exceptions")
+
+# Sharded counters holding the number of entities per kind, globally and per pilot. Each counter is COUNTER_SHARDS
+# "Counter" entities whose counts add up to the total, so concurrent writers rarely touch the same entity.
+COUNTER_KIND = "Counter"
+GLOBAL_SCOPE = "all"
+
+def _scope(user: str) -> str:
+    """Returns the counter scope for the passed pilot, or the global scope if no pilot."""
+    return "pilot:" + user if user else GLOBAL_SCOPE
+
+def _shard_keys(client: object, kind: str, scope: str) -> list:
+    """Returns the keys of every shard of the counter for kind and scope."""
+    return [client.key(COUNTER_KIND, f"{kind}:{scope}:{shard}") for shard in range(COUNTER_SHARDS)]
+
+def increment(client: object, kind: str, user: str, amount: int):
+    """Adds amount to the global counter of kind and, if user passed, to the pilot's counter. Must be called inside a
+    transaction of client so the counters change atomically with the entities they count. A counter that doesn't
+    exist yet is seeded from a COUNT query first, entities already stored before it was created aren't lost."""
+    scopes = [GLOBAL_SCOPE, _scope(user)] if user else [GLOBAL_SCOPE]
+    shard = random.randrange(COUNTER_SHARDS) # Spread writers over the shards.
+    keys = [_shard_keys(client, kind, scope)[shard] for scope in scopes]
+    existing = {entity.key.name: entity for entity in client.get_multi(keys)}
+
+    shards = []
+    for key, scope in zip(keys, scopes):
+        entity = existing.get(key.name)
+        if entity is None: # First write to this shard.
+            entity = datastore.Entity(key)
+            entity.update({"kind": kind, "scope": scope, "count": _seed(client, kind, scope, user)})
+        entity["count"] += amount
+        shards.append(entity)
+    client.put_multi(shards)
+
+def _seed(client: object, kind: str, scope: str, user: str) -> int:
+    """Returns the starting count of a new shard, 0 unless it's the counter's first shard, then the entities already
+    stored. The other shards are only read when a shard is created, so writers to existing shards don't conflict.
+    The COUNT runs in the caller's transaction and doesn't see its pending writes, amount is added on top."""
+    if client.get_multi(_shard_keys(client, kind, scope)): # Counter already exists.
+        return 0
+    return model_helpers.count_items_in_kind(kind, user if scope != GLOBAL_SCOPE else None)
+
+def put_counted(client: object, kind: str, user: str, entities: list):
+    """Stores entities of kind and adds them to the counters, the pilot's too if user passed. Entities are written with
+    put_multi in chunks that fit a single commit along with the counter shards, each chunk in its own transaction."""
+    chunk_size = DATASTORE_MAX_BATCH - (2 if user else 1) # Leave room for the counter shards.
+    for start in range(0, len(entities), chunk_size):
+        model_helpers.run_in_transaction(_put_chunk, client, kind, user, entities[start:start + chunk_size])
+
+def _put_chunk(client: object, kind: str, user: str, chunk: list):
+    """Transaction body of put_counted."""
+    model_helpers.put_multi(chunk)
+    increment(client, kind, user, len(chunk))
+
+def get_count(client: object, kind: str, user: str) -> int:
+    """Returns the number of entities of kind, only those of the pilot if user passed, by summing the counter shards.
+    A counter that was never written is seeded from a COUNT query."""
+    keys = _shard_keys(client, kind, _scope(user))
+    shards = client.get_multi(keys)
+    if shards:
+        return sum(shard["count"] for shard in shards)
+
+    total = model_helpers.count_items_in_kind(kind, user) # Counter doesn't exist yet, count and seed it.
+    try:
+        with client.transaction():
+            if not client.get_multi(keys): # Still empty, nobody created it meanwhile.
+                seed = datastore.Entity(keys[0])
+                seed.update({"kind": kind, "scope": _scope(user), "count": total})
+                client.put(seed)
+    except exceptions.Conflict: # A concurrent request seeded it first.
+        pass
+    return total
+
+def get_total(client: object, kind: str, user: str, exact: bool) -> int:
+    """Returns the total for list responses, exact runs a COUNT query, otherwise the maintained counters are read."""
+    if exact:
+        return model_helpers.count_items_in_kind(kind, user)
+    return get_count(client, kind, user)
+
+def _write_count(client: object, kind: str, scope: str, total: int) -> bool:
+    """Sets the counter for kind and scope to total, zeroing every shard but the first. Returns True if it drifted."""
+    keys = _shard_keys(client, kind, scope)
+    with client.transaction():
+        shards = client.get_multi(keys)
+        if sum(shard["count"] for shard in shards) == total and (shards or total == 0):
+            return False
+
+        repaired = []
+        for i, key in enumerate(keys):
+            entity = datastore.Entity(key)
+            entity.update({"kind": kind, "scope": scope, "count": total if i == 0 else 0})
+            repaired.append(entity)
+        client.put_multi(repaired)
+    return True
+
+def reconcile(client: object, kind: str, per_pilot: bool) -> dict:
+    """Recounts kind from scratch and repairs every counter that drifted, including per pilot counters if per_pilot.
+    Returns a report with the number of counters checked and the scopes that were repaired."""
+    totals = {GLOBAL_SCOPE: model_helpers.count_items_in_kind(kind, None)}
+
+    if per_pilot:
+        query = client.query(kind=kind)
+        query.projection = ["pilot"] # Only the pilot of each entity is needed.
+        pilots = Counter(entity["pilot"] for entity in query.fetch())
+        totals.update({_scope(pilot): count for pilot, count in pilots.items()})
+
+        query = client.query(kind=COUNTER_KIND) # Pilots that no longer own anything still have counters.
+        query.add_filter("kind", "=", kind)
+        for shard in query.fetch():
+            totals.setdefault(shard["scope"], 0)
+
+    repaired = [scope for scope, total in totals.items() if _write_count(client, kind, scope, total)]
+    return {"checked": len(totals), "repaired": repaired}
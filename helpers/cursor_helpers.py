@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+from constants import CURSOR_SECRET
+
+# Opaque page cursors handed to clients in next urls. A cursor wraps the Datastore page token together with the
+# listing it belongs to, signed so clients can't forge or reuse it for another listing.
+
+def _secret() -> bytes:
+    """Returns the signing key, the CURSOR_SECRET environment variable overrides constants.py. On App Engine it must be
+    set, instances would otherwise reject each other's cursors. Elsewhere a random key is used so cursors can't be
+    forged, they're then only valid in the process, or the workers forked from it, that issued them."""
+    secret = os.environ.get("CURSOR_SECRET", CURSOR_SECRET)
+    if secret:
+        return secret.encode()
+    if os.environ.get("GAE_ENV"): # Set by App Engine.
+        raise RuntimeError("CURSOR_SECRET is not set, set it in app.yaml or constants.py")
+    logging.getLogger(__name__).warning("CURSOR_SECRET is not set, signing page cursors with a random key")
+    return secrets.token_bytes(32)
+
+_key = _secret() # Read at import, before gunicorn forks, so the workers of an instance share it.
+
+def _b64encode(data: bytes) -> str:
+    """Returns url safe base64 without padding."""
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    """Decodes url safe base64 that may have lost its padding."""
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: bytes) -> str:
+    """Returns the signature of payload."""
+    return _b64encode(hmac.new(_key, payload, hashlib.sha256).digest()[:16])
+
+def scope(kind: str, user: str) -> str:
+    """Returns the listing a cursor is bound to, the kind and the pilot if user passed."""
+    return kind + ":" + user if user else kind
+
+def encode_cursor(page_token: bytes, scope: str) -> str:
+    """Receives the next_page_token of a Datastore iterator and the listing scope and returns a signed cursor."""
+    payload = json.dumps({"t": page_token.decode(), "s": scope}, separators=(",", ":")).encode()
+    return _b64encode(payload) + "." + _sign(payload)
+
+def decode_cursor(cursor: str, scope: str) -> bytes:
+    """Receives a cursor sent by a client and the listing scope. Returns the Datastore page token, or None if the
+    cursor is malformed, was tampered with or belongs to another listing."""
+    try:
+        encoded, signature = cursor.split(".")
+        payload = _b64decode(encoded)
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        content = json.loads(payload)
+    except (ValueError, TypeError):
+        return None
+
+    if not isinstance(content, dict) or content.get("s") != scope or not isinstance(content.get("t"), str):
+        return None
+    return content["t"].encode()
@@ -0,0 +1,125 @@
+import os
+import pickle
+import threading
+from collections import defaultdict
+from helpers.import_helpers import lazy_import
+import helpers.client_helpers as client_helpers
+from helpers.cache_helpers import LocalBackend, RedisBackend
+from constants import ENTITY_CACHE_ENABLED, ENTITY_CACHE_BACKEND, ENTITY_CACHE_REDIS_URL, ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL
+
+datastore = lazy_import("google.cloud.datastore")
+
+# Read-through cache of Airplane and Cargo entities keyed by Datastore key. Every write goes through
+# model_helpers.put_multi/delete_multi which stamp a version and refresh the cache once the transaction commits.
+# Cached values carry that version, so a read that raced with a write can't replace the newer value.
+client = client_helpers.client
+_pending = threading.local() # Cache updates staged by the running transaction.
+_stats = defaultdict(lambda: {"hits": 0, "misses": 0, "fills": 0, "stale_fills": 0, "writes": 0})
+_stats_lock = threading.Lock()
+
+def _make_backend() -> object:
+    """Builds the configured backend, the local one if redis is chosen but not installed."""
+    if ENTITY_CACHE_BACKEND == "redis":
+        try:
+            return RedisBackend(ENTITY_CACHE_REDIS_URL, ENTITY_CACHE_TTL)
+        except ImportError:
+            print("redis is not installed, using the local entity cache")
+    return LocalBackend(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+
+_backend = _make_backend()
+
+def _enabled() -> bool:
+    """Returns True if entities are cached. A local cache is left off when several worker processes serve requests,
+    each would keep its own copy and serve an entity and its ETag for up to the TTL after another worker changed it."""
+    if not ENTITY_CACHE_ENABLED:
+        return False
+    if isinstance(_backend, LocalBackend) and int(os.environ.get("WEB_CONCURRENCY", "1")) > 1:
+        print("Local entity cache off with several workers, set ENTITY_CACHE_BACKEND to redis to share one")
+        return False
+    return True
+
+_cache_enabled = _enabled()
+
+def _cache_key(key: object) -> str:
+    """Returns the cache key of a Datastore key, e.g. Airplane/1234."""
+    return "/".join(str(part) for part in key.flat_path)
+
+def _dump(entity: object) -> bytes:
+    """Serialises the entity's properties, which also copies them so later changes to the entity aren't cached."""
+    return pickle.dumps((dict(entity), list(entity.exclude_from_indexes)))
+
+def _load(key: object, data: bytes) -> object:
+    """Builds a fresh entity for key from cached data."""
+    properties, exclude_from_indexes = pickle.loads(data)
+    entity = datastore.Entity(key, exclude_from_indexes=exclude_from_indexes)
+    entity.update(properties)
+    return entity
+
+def _count(kind: str, counter: str):
+    """Adds one to a cache counter of kind."""
+    with _stats_lock:
+        _stats[kind][counter] += 1
+
+def _fill(entity: object):
+    """Caches an entity read from Datastore, unless the cache already holds the same or a newer version."""
+    if _backend.set_if_newer(_cache_key(entity.key), entity.get("version", 0), _dump(entity)):
+        _count(entity.key.kind, "fills")
+    else:
+        _count(entity.key.kind, "stale_fills")
+
+def get(key: object) -> object:
+    """Returns the entity for key from the cache, or reads it from Datastore and caches it. None if it doesn't exist.
+    The returned entity is a copy the caller may change."""
+    if not _cache_enabled:
+        return client.get(key)
+
+    try:
+        cached = _backend.get(_cache_key(key))
+    except Exception as e: # Shared backend unreachable, read from Datastore.
+        print(f"Entity cache error: {e}")
+        return client.get(key)
+    
+    if cached is not None: # Either the entity or a marker that it was deleted.
+        _count(key.kind, "hits")
+        return _load(key, cached[1]) if cached[1] else None
+
+    _count(key.kind, "misses")
+    entity = client.get(key)
+    if entity:
+        _fill(entity)
+    return entity
+
+def begin():
+    """Clears the cache updates staged by a previous attempt of the transaction on this thread."""
+    _pending.updates = []
+
+def stage_put(entities: list):
+    """Remembers entities written by the running transaction, cached once it commits."""
+    _pending.updates.extend((entity.key, entity["version"], _dump(entity)) for entity in entities)
+
+def stage_delete(entities: list):
+    """Remembers entities deleted by the running transaction. Once it commits a deletion marker with the next version
+    replaces them so concurrent reads can't cache them again."""
+    _pending.updates.extend((entity.key, entity.get("version", 0) + 1, None) for entity in entities)
+
+def commit():
+    """Applies the staged cache updates, called after the transaction committed."""
+    if not _cache_enabled:
+        return
+    updates, _pending.updates = getattr(_pending, "updates", []), []
+    for key, version, data in updates:
+        try:
+            _backend.set_if_newer(_cache_key(key), version, data)
+            _count(key.kind, "writes")
+        except Exception as e: # The write is committed, a cache failure only leaves the old value until its TTL.
+            print(f"Entity cache error: {e}")
+
+def get_stats() -> dict:
+    """Returns the cache counters and hit ratio per kind."""
+    with _stats_lock:
+        counts = {kind: dict(counters) for kind, counters in _stats.items()}
+    stats = {}
+    for kind, counters in counts.items():
+        lookups = counters["hits"] + counters["misses"]
+        stats[kind] = dict(counters, hit_ratio=round(counters["hits"] / lookups, 4) if lookups else None)
+    return stats
@@ -0,0 +1,37 @@
+import importlib
+
+# Heavy modules imported on first use instead of at startup. google.cloud.datastore pulls in gRPC, protobuf and
+# google-auth and python-jose pulls in its crypto backends, together most of the app's import time. Modules bind the
+# stand-in at import time like they would the module and use it the same way, every attribute is looked up on the real
+# module which is imported the first time one is needed.
+
+_modules = {} # Name to stand-in of every lazily imported module.
+
+class _LazyModule:
+    """Stands in for a module until one of its attributes is needed."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self) -> object:
+        """Imports the module, import_module is thread safe so concurrent first uses import it once."""
+        self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, name):
+        return getattr(self._module or self._load(), name)
+
+    def __repr__(self) -> str:
+        return f"<lazy module {self._name!r}{' (loaded)' if self._module else ''}>"
+
+def lazy_import(name: str) -> object:
+    """Returns a stand-in for the module name, imported when one of its attributes is first used."""
+    if name not in _modules:
+        _modules[name] = _LazyModule(name)
+    return _modules[name]
+
+def load_all():
+    """Imports every lazily imported module, e.g. in a warmup request or before a server forks its workers."""
+    for module in list(_modules.values()):
+        module._module or module._load()
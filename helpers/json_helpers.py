@@ -0,0 +1,53 @@
+from flask.json.provider import DefaultJSONProvider, _default
+from helpers.import_helpers import lazy_import
+from constants import JSON_ENCODER
+
+datastore = lazy_import("google.cloud.datastore")
+
+# JSON provider of the app. Entities are dicts and are encoded as they are, without a dict() copy. orjson is used when
+# installed and JSON_ENCODER allows it, otherwise the stdlib json module. Both produce the same documents: sorted keys
+# and datetimes in the HTTP date format Flask uses. orjson writes non-ASCII characters as UTF-8 instead of escaping them.
+try:
+    import orjson # Optional dependency, only needed for the fast encoder.
+except ImportError:
+    orjson = None
+
+def _encode_default(o: object) -> object:
+    """Encodes the types json can't, keys become their id or name, or their flat path if they have a parent."""
+    if isinstance(o, datastore.Key):
+        return o.id_or_name if o.parent is None else list(o.flat_path)
+    return _default(o) # Dates, decimals, uuids, dataclasses, otherwise TypeError.
+
+class FastJSONProvider(DefaultJSONProvider):
+    """DefaultJSONProvider that handles Datastore keys and encodes and decodes with orjson when available."""
+
+    default = staticmethod(_encode_default)
+    fast = orjson is not None and JSON_ENCODER != "stdlib"
+
+    def _orjson_options(self) -> int:
+        """Returns the orjson options matching the provider's settings."""
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS # Dates go through default like json.
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj: object, **kwargs) -> str:
+        """Serializes obj to a JSON string. Calls with json.dumps arguments are handled by the stdlib."""
+        if not self.fast or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._orjson_options()).decode()
+
+    def loads(self, s: object, **kwargs) -> object:
+        """Deserializes a JSON string or UTF-8 bytes."""
+        if not self.fast or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs) -> object:
+        """Returns a JSON response like jsonify. Compact responses are encoded straight to bytes with orjson, indented
+        ones in debug mode by the stdlib."""
+        if not self.fast or self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._orjson_options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from urllib.request import urlopen
+from constants import DOMAIN, JWKS_DEFAULT_MAX_AGE, JWKS_REFRESH_MARGIN, JWKS_MIN_REFETCH_INTERVAL, JWKS_FETCH_TIMEOUT
+
+JWKS_URL = "https://" + DOMAIN + "/.well-known/jwks.json"
+
+# Process wide JWKS key store, signing keys indexed by kid.
+_lock = threading.Lock()
+_fetch_lock = threading.Lock() # Serialises fetches so concurrent requests don't stampede the identity provider.
+_keys = {}
+_expires_at = 0.0
+_last_fetch = 0.0
+_refresh_timer = None
+_async_fetch = None # Fetch awaited by async requests, shared so concurrent ones wait for the same.
+_stats = {"hits": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0, "unknown_kid_refetches": 0}
+
+def _max_age(cache_control: str) -> int:
+    """Receives a Cache-Control header value and returns its max-age in seconds, or the default if there is none."""
+    match = re.search(r"max-age=(\d+)", cache_control or "")
+    if not match or "no-cache" in cache_control or "no-store" in cache_control:
+        return JWKS_DEFAULT_MAX_AGE
+    return int(match.group(1))
+
+def _fetch_jwks() -> tuple:
+    """Fetches the JWKS document from the identity provider and returns the keys indexed by kid and their max-age."""
+    response = urlopen(JWKS_URL, timeout=JWKS_FETCH_TIMEOUT)
+    jwks = json.loads(response.read())
+    keys = {}
+    for key in jwks["keys"]: # Keep only the fields needed to verify RS256 signatures.
+        keys[key["kid"]] = {"kty": key["kty"], "kid": key["kid"], "use": key["use"], "n": key["n"], "e": key["e"]}
+    return keys, _max_age(response.headers.get("Cache-Control"))
+
+def _schedule_refresh(delay: float):
+    """Schedules a background refresh of the key store after delay seconds, replacing any pending one. Refreshes are
+    at least JWKS_MIN_REFETCH_INTERVAL apart, however short the max-age the identity provider sends."""
+    global _refresh_timer
+    if _refresh_timer is not None:
+        _refresh_timer.cancel()
+    _refresh_timer = threading.Timer(max(delay, JWKS_MIN_REFETCH_INTERVAL), _background_refresh)
+    _refresh_timer.daemon = True # Never keep the process alive just to refresh keys.
+    _refresh_timer.start()
+
+def _background_refresh():
+    """Timer target, refreshes the keys and swallows errors so the old keys keep being served."""
+    try:
+        refresh_keys()
+    except Exception as e:
+        print(f"JWKS refresh error: {e}")
+
+def refresh_keys(requested_at: float = None):
+    """Fetches the JWKS and replaces the cached keys. On failure the cached keys are kept and a retry is scheduled.
+    If requested_at is passed the fetch is skipped when another thread already fetched after that time."""
+    global _keys, _expires_at, _last_fetch
+    with _fetch_lock:
+        if requested_at is not None and _last_fetch > requested_at: # Another thread refreshed while we waited.
+            return
+        _last_fetch = time.monotonic()
+        try:
+            keys, max_age = _fetch_jwks()
+        except Exception:
+            with _lock:
+                _stats["refresh_errors"] += 1
+                _schedule_refresh(JWKS_MIN_REFETCH_INTERVAL)
+            raise
+
+        with _lock:
+            _keys = keys
+            _expires_at = time.monotonic() + max_age
+            _stats["refreshes"] += 1
+            # Refresh in the background before the keys expire, halfway through if max-age is within the margin.
+            _schedule_refresh(max(max_age - JWKS_REFRESH_MARGIN, max_age / 2))
+
+def after_fork():
+    """Restarts the background refresh in a forked worker, the parent's timer thread isn't copied by fork. The keys
+    are kept, they're valid until the same expiry."""
+    global _lock, _fetch_lock, _refresh_timer
+    _lock = threading.Lock() # May have been held by the parent's timer.
+    _fetch_lock = threading.Lock()
+    _refresh_timer = None
+    if _keys:
+        _schedule_refresh(_expires_at - time.monotonic() - JWKS_REFRESH_MARGIN)
+
+def get_signing_key(kid: str) -> dict:
+    """Receives a kid and returns the matching RSA key from the key store, or None if the identity provider has no
+    such key. Keys are only fetched on the request path when the store is empty or has expired, or when an unknown kid
+    is seen and the last fetch is older than the refetch interval."""
+    now = time.monotonic()
+    if not _keys:
+        refresh_keys(now) # Nothing to serve yet, errors propagate to the caller.
+    elif now >= _expires_at:
+        try:
+            refresh_keys(now)
+        except Exception: # Identity provider unreachable, keep serving the expired keys.
+            pass
+
+    key = _keys.get(kid)
+    if key:
+        with _lock:
+            _stats["hits"] += 1
+        return key
+
+    with _lock:
+        _stats["misses"] += 1
+    if now - _last_fetch < JWKS_MIN_REFETCH_INTERVAL: # Rate limit refetches from unknown kids.
+        return None
+
+    with _lock:
+        _stats["unknown_kid_refetches"] += 1
+    try:
+        refresh_keys(now) # kid may belong to a newly rotated key.
+    except Exception:
+        return None
+    return _keys.get(kid)
+
+def _needs_fetch(kid: str, now: float) -> bool:
+    """Returns True if get_signing_key would fetch the JWKS for kid."""
+    if not _keys or now >= _expires_at:
+        return True
+    return kid not in _keys and now - _last_fetch >= JWKS_MIN_REFETCH_INTERVAL
+
+async def prefetch(kid: str):
+    """Fetches the JWKS if get_signing_key would for kid, so async requests await the fetch instead of blocking on it.
+    The fetch runs in a thread, concurrent callers share it. Errors are left to get_signing_key to handle."""
+    global _async_fetch
+    now = time.monotonic()
+    if not _needs_fetch(kid, now):
+        return
+    loop = asyncio.get_running_loop()
+    if _async_fetch is None or _async_fetch.done() or _async_fetch.get_loop() is not loop:
+        _async_fetch = loop.create_task(asyncio.to_thread(refresh_keys, now))
+    try:
+        await asyncio.shield(_async_fetch)
+    except Exception:
+        pass
+
+def get_stats() -> dict:
+    """Returns a copy of the key store counters along with the number of cached keys."""
+    with _lock:
+        stats = dict(_stats)
+        stats["keys"] = len(_keys)
+    return stats
@@ -0,0 +1,424 @@
+import base64
+import copy
+import hashlib
+import hmac
+import itertools
+import os
+import pickle
+import threading
+import time
+from datetime import datetime
+from google.api_core.exceptions import Aborted, BadRequest
+from google.cloud import datastore
+
+# In-memory stand-in for datastore.Client, selected with DATASTORE_BACKEND = "memory". It covers what the models use:
+# get/put/delete and their _multi forms, allocate_ids, transactions, filtered, ordered and projected queries with
+# offsets and cursors, and COUNT aggregations. Entities are copied in and out like they would be serialised over the
+# wire. Every simulated RPC sleeps the configured latency. Transactions are optimistic, the commit is aborted if an
+# entity read by the transaction changed since, so the retry path of run_in_transaction runs like against Datastore.
+
+def _path(key: object) -> tuple:
+    """Returns the storage key of a complete Datastore key."""
+    return key.flat_path
+
+def _key_order(key: object) -> tuple:
+    """Returns a sortable form of key, kind by kind with ids before names like Datastore."""
+    path = key.flat_path
+    return tuple((path[i], (0, path[i + 1]) if isinstance(path[i + 1], int) else (1, path[i + 1]))
+                 for i in range(0, len(path), 2))
+
+def _sort_value(value: object) -> tuple:
+    """Returns a sortable form of a property value, values of different types ordered by type like Datastore."""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (3, value)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, datetime):
+        return (2, value.timestamp())
+    if isinstance(value, bytes):
+        return (4, value)
+    if isinstance(value, str):
+        return (5, value)
+    if isinstance(value, datastore.Key):
+        return (6, _key_order(value))
+    return (7, repr(value))
+
+def _copy_entity(entity: object, key: object = None, properties: list = None) -> object:
+    """Returns a deep copy of entity, with key instead of its own if passed and only the listed properties if passed."""
+    new_entity = datastore.Entity(key or entity.key, exclude_from_indexes=tuple(entity.exclude_from_indexes))
+    values = entity if properties is None else {name: entity[name] for name in properties}
+    new_entity.update(copy.deepcopy(dict(values)))
+    return new_entity
+
+class AggregationResult:
+    """One aggregated value of an aggregation query result row."""
+
+    def __init__(self, alias: str, value: int):
+        self.alias = alias
+        self.value = value
+
+class MemoryClient:
+    """Process local Datastore client, see the module comment. latency is the seconds slept per simulated RPC."""
+
+    def __init__(self, project: str = "local", latency: float = 0.0):
+        self.project = project
+        self.namespace = None
+        self.latency = latency
+        self._entities = {} # Storage key to the stored entity.
+        self._versions = {} # Storage key to the number of writes so far, deletions included.
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+        self._local = threading.local() # Stack of the transactions running on each thread.
+        self._cursor_secret = os.urandom(16) # Cursors are only valid in the process that issued them.
+
+    def _rpc(self):
+        """Simulates the cost of a round trip to Datastore."""
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def _stack(self) -> list:
+        """Returns the transaction stack of this thread."""
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    @property
+    def current_transaction(self) -> object:
+        """The innermost transaction running on this thread, or None."""
+        stack = self._stack()
+        return stack[-1] if stack else None
+
+    current_batch = current_transaction
+
+    def key(self, *path_args, **kwargs) -> object:
+        """Returns a key of this client's project."""
+        kwargs.setdefault("project", self.project)
+        return datastore.Key(*path_args, **kwargs)
+
+    def _allocate(self, key: object) -> object:
+        """Completes a partial key with a new id."""
+        return key.completed_key(next(self._ids))
+
+    def allocate_ids(self, incomplete_key: object, num_ids: int, **kwargs) -> list:
+        """Returns num_ids complete keys with new ids for the partial key."""
+        if not incomplete_key.is_partial:
+            raise ValueError("Key is not partial.")
+        self._rpc()
+        with self._lock:
+            return [self._allocate(incomplete_key) for _ in range(num_ids)]
+
+    def get(self, key: object, missing: list = None, deferred: list = None, transaction: object = None, **kwargs):
+        """Returns a copy of the entity stored under key, or None."""
+        entities = self.get_multi([key], missing=missing, deferred=deferred, transaction=transaction)
+        return entities[0] if entities else None
+
+    def get_multi(self, keys: list, missing: list = None, deferred: list = None, transaction: object = None,
+                  **kwargs) -> list:
+        """Returns copies of the entities stored under keys, in the order of keys and skipping those not found. Inside
+        a transaction the versions read are remembered so the commit can detect conflicting writes."""
+        transaction = transaction or self.current_transaction
+        self._rpc()
+        found = []
+        with self._lock:
+            for key in keys:
+                path = _path(key)
+                if transaction is not None:
+                    transaction._reads.setdefault(path, self._versions.get(path, 0))
+                entity = self._entities.get(path)
+                if entity is not None:
+                    found.append(_copy_entity(entity))
+                elif missing is not None:
+                    missing.append(datastore.Entity(key))
+        return found
+
+    def put(self, entity: object, **kwargs):
+        """Stores entity, see put_multi."""
+        self.put_multi([entity])
+
+    def put_multi(self, entities: list, **kwargs):
+        """Stores copies of entities, completing partial keys. Inside a transaction the writes are applied when it
+        commits."""
+        self._mutate(self._put_mutations(entities))
+
+    def delete(self, key: object, **kwargs):
+        """Deletes the entity stored under key, see delete_multi."""
+        self.delete_multi([key])
+
+    def delete_multi(self, keys: list, **kwargs):
+        """Deletes the entities stored under keys. Inside a transaction the deletes are applied when it commits."""
+        self._mutate([("delete", _path(key), None) for key in keys])
+
+    def _put_mutations(self, entities: list) -> list:
+        """Returns the mutations writing copies of entities, partial keys are completed first."""
+        with self._lock:
+            for entity in entities:
+                if entity.key.is_partial:
+                    entity.key = self._allocate(entity.key)
+        return [("put", _path(entity.key), _copy_entity(entity)) for entity in entities]
+
+    def _mutate(self, mutations: list):
+        """Queues mutations on the running transaction, or applies them as one commit."""
+        transaction = self.current_transaction
+        if transaction is not None:
+            transaction._mutations.extend(mutations)
+            return
+        self._rpc()
+        with self._lock:
+            self._apply(mutations)
+
+    def _apply(self, mutations: list):
+        """Applies mutations to the store, the lock must be held."""
+        for operation, path, entity in mutations:
+            if operation == "put":
+                self._entities[path] = entity
+            else:
+                self._entities.pop(path, None)
+            self._versions[path] = self._versions.get(path, 0) + 1
+
+    def transaction(self, **kwargs) -> object:
+        """Returns a new transaction, used as a context manager that commits on exit."""
+        return MemoryTransaction(self)
+
+    def query(self, **kwargs) -> object:
+        """Returns a new query, takes the same keyword arguments as datastore.Client.query."""
+        return MemoryQuery(self, **kwargs)
+
+    def aggregation_query(self, query: object, **kwargs) -> object:
+        """Returns an aggregation over the results of query."""
+        return MemoryAggregationQuery(self, query)
+
+    def _encode_cursor(self, position: tuple) -> bytes:
+        """Returns a url safe page token for the position after an entity."""
+        payload = pickle.dumps(position)
+        signature = hmac.new(self._cursor_secret, payload, hashlib.sha256).digest()[:16]
+        return base64.urlsafe_b64encode(signature + payload)
+
+    def _decode_cursor(self, cursor: object) -> tuple:
+        """Returns the position held by a page token issued by this client."""
+        try:
+            data = base64.urlsafe_b64decode(cursor)
+        except (ValueError, TypeError):
+            raise BadRequest("Invalid query cursor.")
+        signature, payload = data[:16], data[16:]
+        if not hmac.compare_digest(signature, hmac.new(self._cursor_secret, payload, hashlib.sha256).digest()[:16]):
+            raise BadRequest("Invalid query cursor.")
+        return pickle.loads(payload)
+
+    def _run_query(self, query: object) -> tuple:
+        """Returns the stored entities matching query in query order, each with its position, and the direction of
+        every position field. The entities aren't copied, callers copy those they return."""
+        ancestor = _path(query.ancestor) if query.ancestor is not None else ()
+        with self._lock:
+            candidates = [entity for path, entity in self._entities.items()
+                          if (query.kind is None or path[-2] == query.kind) and path[:len(ancestor)] == ancestor]
+        required = [name for name in query.projection if name != "__key__"]
+        required += [name.lstrip("-") for name in query.order] + [query_filter[0] for query_filter in query.filters]
+        required = [name for name in required if name != "__key__"]
+
+        matches = []
+        for entity in candidates:
+            if any(name not in entity for name in required): # Unindexed for this query.
+                continue
+            if not all(query._matches(entity, *query_filter) for query_filter in query.filters):
+                continue
+            matches.append(entity)
+
+        order = [(name.lstrip("-"), name.startswith("-")) for name in query.order if name.lstrip("-") != "__key__"]
+        key_descending = "-__key__" in query.order
+        matches.sort(key=lambda entity: _key_order(entity.key), reverse=key_descending) # Ties broken by key.
+        for name, descending in reversed(order):
+            matches.sort(key=lambda entity: _sort_value(entity[name]), reverse=descending)
+
+        results = [(entity, tuple(_sort_value(entity[name]) for name, _ in order) + (_key_order(entity.key),))
+                   for entity in matches]
+        return results, [descending for _, descending in order] + [key_descending]
+
+class MemoryTransaction:
+    """Transaction of a MemoryClient. Writes are buffered and applied at commit, which is aborted with Aborted, a
+    Conflict, if any entity read in the transaction was written by someone else since."""
+
+    def __init__(self, client: MemoryClient):
+        self._client = client
+        self._reads = {}
+        self._mutations = []
+        self.id = None
+
+    def begin(self):
+        """Starts the transaction."""
+        self._client._rpc()
+        self.id = os.urandom(8).hex()
+
+    @property
+    def mutations(self) -> list:
+        """Returns the buffered writes, like the mutations of a datastore.Transaction."""
+        return self._mutations
+
+    def put(self, entity: object):
+        """Buffers a write of entity."""
+        self._mutations.extend(self._client._put_mutations([entity]))
+
+    def delete(self, key: object):
+        """Buffers a delete of key."""
+        self._mutations.append(("delete", _path(key), None))
+
+    def commit(self):
+        """Applies the buffered writes unless an entity read changed since it was read."""
+        self._client._rpc()
+        with self._client._lock:
+            for path, version in self._reads.items():
+                if self._client._versions.get(path, 0) != version:
+                    raise Aborted("too much contention on these datastore entities. please try again.")
+            self._client._apply(self._mutations)
+
+    def rollback(self):
+        """Discards the buffered writes."""
+        self._client._rpc()
+        self._mutations = []
+
+    def __enter__(self):
+        self.begin()
+        self._client._stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.rollback()
+        finally:
+            self._client._stack().pop()
+
+class MemoryQuery:
+    """Query of a MemoryClient with the interface of datastore.Query."""
+
+    OPERATORS = {
+        "=": lambda a, b: a == b, "!=": lambda a, b: a != b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+        ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+        "IN": lambda a, b: a in b, "NOT_IN": lambda a, b: a not in b,
+    }
+
+    def __init__(self, client: MemoryClient, kind: str = None, ancestor: object = None, filters: list = (),
+                 projection: list = (), order: list = (), **kwargs):
+        self._client = client
+        self.kind = kind
+        self.ancestor = ancestor
+        self.filters = []
+        self.projection = list(projection)
+        self.order = list(order)
+        for query_filter in filters:
+            self.add_filter(*query_filter)
+
+    def add_filter(self, property_name: str = None, operator: str = None, value: object = None, *, filter=None):
+        """Adds a property filter, passed as arguments or as a PropertyFilter."""
+        if filter is not None:
+            property_name, operator, value = filter.property_name, filter.operator, filter.value
+        if operator not in self.OPERATORS:
+            raise ValueError(f"Invalid expression: {operator}")
+        self.filters.append((property_name, operator, value))
+        return self
+
+    def keys_only(self):
+        """Makes the query return entities without properties."""
+        self.projection = ["__key__"]
+
+    def _matches(self, entity: object, property_name: str, operator: str, value: object) -> bool:
+        """Returns True if any value of the property satisfies the filter, list properties match per element."""
+        if property_name == "__key__":
+            candidates = [entity.key]
+        else:
+            candidates = entity[property_name] if isinstance(entity[property_name], list) else [entity[property_name]]
+        compare = self.OPERATORS[operator]
+        if operator in ("IN", "NOT_IN"):
+            value = [_sort_value(item) for item in value]
+        else:
+            value = _sort_value(value)
+        return any(compare(_sort_value(candidate), value) for candidate in candidates)
+
+    def fetch(self, limit: int = None, offset: int = 0, start_cursor: object = None, end_cursor: object = None,
+              **kwargs) -> object:
+        """Returns an iterator over the results, one page of up to limit entities."""
+        return MemoryIterator(self, limit, offset, start_cursor, end_cursor)
+
+class MemoryIterator:
+    """Result iterator of a MemoryQuery with the pages and next_page_token of the Datastore iterator."""
+
+    def __init__(self, query: MemoryQuery, limit: int, offset: int, start_cursor: object, end_cursor: object):
+        self._query = query
+        self._limit = limit
+        self._offset = offset or 0
+        self._start_cursor = start_cursor
+        self._end_cursor = end_cursor
+        self._started = False
+        self.next_page_token = None
+        self.num_results = 0
+
+    @staticmethod
+    def _after(values: tuple, cursor: tuple, descending: list) -> bool:
+        """Returns True if a result at values comes after the cursor position in query order."""
+        for value, position, reverse in zip(values, cursor, descending):
+            if value != position:
+                return (value < position) if reverse else (value > position)
+        return False
+
+    def _page(self) -> list:
+        """Runs the query and returns the entities of the page."""
+        client = self._query._client
+        client._rpc()
+        if (self._limit is not None and self._limit < 0) or self._offset < 0: # Datastore rejects them too.
+            raise BadRequest("Query limit and offset must not be negative.")
+        results, descending = client._run_query(self._query)
+        if self._start_cursor:
+            start = client._decode_cursor(self._start_cursor)
+            results = [result for result in results if self._after(result[1], start, descending)]
+        if self._end_cursor:
+            end = client._decode_cursor(self._end_cursor)
+            results = [result for result in results if not self._after(result[1], end, descending)]
+        results = results[self._offset:]
+
+        if self._limit == 0: # Empty page, there's no position to continue from.
+            results = []
+            self.next_page_token = None
+        elif self._limit is not None and len(results) > self._limit: # More results after this page.
+            results = results[:self._limit]
+            self.next_page_token = client._encode_cursor(results[-1][1])
+        else:
+            self.next_page_token = None
+        self.num_results = len(results)
+        projection = [name for name in self._query.projection if name != "__key__"]
+        if self._query.projection: # Only the projected properties, none if keys only.
+            return [_copy_entity(entity, properties=projection) for entity, _ in results]
+        return [_copy_entity(entity) for entity, _ in results]
+
+    @property
+    def pages(self) -> object:
+        """Yields the single page of results."""
+        if not self._started:
+            self._started = True
+            yield iter(self._page())
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+class MemoryAggregationQuery:
+    """Aggregation over a MemoryQuery, only COUNT is supported."""
+
+    def __init__(self, client: MemoryClient, query: MemoryQuery):
+        self._client = client
+        self._query = query
+        self._aliases = []
+
+    def count(self, alias: str = None) -> object:
+        """Adds a count of the query results."""
+        self._aliases.append(alias or "property_" + str(len(self._aliases) + 1))
+        return self
+
+    def fetch(self, limit: int = None, **kwargs) -> object:
+        """Yields the single result row, a list with one AggregationResult per aggregation."""
+        self._client._rpc()
+        results, _ = self._client._run_query(self._query)
+        total = len(results) if limit is None else min(len(results), limit)
+        yield [AggregationResult(alias, total) for alias in self._aliases]
@@ -0,0 +1,260 @@
+import atexit
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from flask import g, request
+from constants import METRICS_DIR, METRICS_FLUSH_INTERVAL, METRICS_LATENCY_BUCKETS
+
+# Metrics in the Prometheus text exposition format. Each thread records into its own shard, a dict only it writes, so
+# recording takes no lock. Shards are summed when the metrics are read, copying a dict with list() is atomic under the
+# GIL. Shards of finished threads are folded into _retired so servers starting a thread per request don't pile them up.
+# With several worker processes each writes its values to METRICS_DIR every METRICS_FLUSH_INTERVAL seconds and /metrics
+# sums every process' file, gauges of processes that exited are dropped.
+
+# Name to (type, help) of every metric.
+METRICS = {
+    "http_request_duration_seconds": ("histogram", "Request latency by endpoint and status, streamed bodies included."),
+    "http_requests_in_flight": ("gauge", "Requests being served by endpoint."),
+    "jwt_verifications_total": ("counter", "JWT verifications by outcome and whether the result was cached."),
+    "cache_requests_total": ("counter", "Cache lookups by cache and result."),
+    "cache_hit_ratio": ("gauge", "Share of cache lookups that hit since the processes started."),
+    "datastore_rpc_duration_seconds": ("histogram", "Datastore RPC latency by operation."),
+    "datastore_rpc_errors_total": ("counter", "Datastore RPCs that raised, by operation."),
+}
+
+_local = threading.local()
+_shards_lock = threading.Lock() # Only taken when a thread records for the first time and when reading.
+_shards = [] # (thread, values) of every thread that recorded, values map (name, labels) to a number or histogram.
+_retired = {} # Values of finished threads.
+_flush_lock = threading.Lock()
+_next_flush = 0.0
+
+def _metrics_dir() -> str:
+    """Returns the directory shared by the worker processes, or None, the environment variable overrides constants.py."""
+    return os.environ.get("METRICS_DIR", METRICS_DIR)
+
+def _shard() -> dict:
+    """Returns the values of the current thread, registering them on first use."""
+    try:
+        return _local.values
+    except AttributeError:
+        values = _local.values = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), values))
+        return values
+
+def inc(name: str, labels: tuple = (), amount: float = 1):
+    """Adds amount to a counter or gauge, labels are (label, value) pairs."""
+    values = _shard()
+    key = (name, labels)
+    values[key] = values.get(key, 0) + amount
+
+def observe(name: str, labels: tuple, value: float, buckets: tuple = METRICS_LATENCY_BUCKETS):
+    """Adds value to a histogram, stored as the count of each bucket, the +Inf bucket, then the sum."""
+    values = _shard()
+    key = (name, labels)
+    histogram = values.get(key)
+    if histogram is None:
+        histogram = values[key] = [buckets] + [0] * (len(buckets) + 2)
+    histogram[1 + bisect.bisect_left(buckets, value)] += 1
+    histogram[-1] += value
+
+def _merge(into: dict, name: str, labels: tuple, value: object):
+    """Adds a counter, gauge or histogram value to into."""
+    key = (name, labels)
+    if not isinstance(value, list):
+        into[key] = into.get(key, 0) + value
+        return
+    current = into.get(key)
+    if current is None:
+        into[key] = [tuple(value[0])] + list(value[1:])
+    else:
+        into[key] = [current[0]] + [a + b for a, b in zip(current[1:], value[1:])]
+
+def _local_values() -> dict:
+    """Returns the values of this process, summed over its threads."""
+    merged = {}
+    with _shards_lock:
+        for thread, values in list(_shards):
+            if not thread.is_alive(): # Fold finished threads so their shard can go.
+                _shards.remove((thread, values))
+                for (name, labels), value in list(values.items()):
+                    _merge(_retired, name, labels, value)
+        shards = [values for _, values in _shards] + [_retired]
+        for values in shards:
+            for (name, labels), value in list(values.items()):
+                _merge(merged, name, labels, value)
+    for name, labels, value in _cache_values():
+        _merge(merged, name, labels, value)
+    return merged
+
+def _cache_values() -> list:
+    """Returns the hit and miss counters of the caches, read from their own stats when the metrics are read."""
+    import helpers.entity_cache_helpers as entity_cache_helpers
+    import helpers.jwks_helpers as jwks_helpers
+    import helpers.token_helpers as token_helpers
+    import models.user_model as user_model
+
+    tokens = token_helpers.get_stats()
+    caches = {"token_verified": tokens["verified"], "token_rejected": tokens["rejected"], "jwks": jwks_helpers.get_stats(),
+              "user": user_model.get_stats()}
+    for kind, counters in entity_cache_helpers.get_stats().items():
+        caches["entity_" + kind.lower()] = counters
+    return [("cache_requests_total", (("cache", cache), ("result", result)), counters[counter])
+            for cache, counters in caches.items() for result, counter in (("hit", "hits"), ("miss", "misses"))]
+
+def _snapshot_path(pid: int) -> str:
+    """Returns the file holding the values of process pid."""
+    return os.path.join(_metrics_dir(), f"metrics-{pid}.json")
+
+def flush():
+    """Writes the values of this process to its file in METRICS_DIR, replaced atomically so readers never see it half
+    written."""
+    if not _metrics_dir():
+        return
+    path = _snapshot_path(os.getpid())
+    rows = [[name, labels, value] for (name, labels), value in _local_values().items()]
+    with open(path + ".tmp", "w") as snapshot:
+        json.dump(rows, snapshot)
+    os.replace(path + ".tmp", path)
+
+def _alive(pid: int) -> bool:
+    """Returns True if process pid is still running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError: # Running as another user.
+        return True
+    return True
+
+def collect() -> dict:
+    """Returns the values of every worker process, or of this one if METRICS_DIR isn't set."""
+    merged = _local_values()
+    if not _metrics_dir():
+        return merged
+
+    for path in glob.glob(_snapshot_path("*")):
+        pid = int(os.path.basename(path)[len("metrics-"):-len(".json")])
+        if pid == os.getpid():
+            continue
+        try:
+            with open(path) as snapshot:
+                rows = json.load(snapshot)
+        except (OSError, ValueError): # Removed or replaced while reading.
+            continue
+        alive = _alive(pid)
+        for name, labels, value in rows:
+            if METRICS[name][0] == "gauge" and not alive:
+                continue
+            _merge(merged, name, tuple(tuple(label) for label in labels), value)
+    return merged
+
+def _escape(value: str) -> str:
+    """Escapes a label value."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: tuple) -> str:
+    """Returns labels formatted for a sample line."""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+def _number(value: float) -> str:
+    """Returns value formatted for a sample line."""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _cache_ratios(values: dict) -> dict:
+    """Returns the cache_hit_ratio gauges derived from the summed cache counters."""
+    lookups = {}
+    for (name, labels), value in values.items():
+        if name == "cache_requests_total":
+            cache, result = labels[0][1], labels[1][1]
+            lookups.setdefault(cache, {"hit": 0, "miss": 0})[result] += value
+    return {("cache_hit_ratio", (("cache", cache),)): counts["hit"] / (counts["hit"] + counts["miss"])
+            for cache, counts in lookups.items() if counts["hit"] + counts["miss"]}
+
+def render() -> str:
+    """Returns every metric in the Prometheus text exposition format."""
+    values = collect()
+    values.update(_cache_ratios(values))
+    lines = []
+    for name, (kind, help_text) in METRICS.items():
+        samples = sorted((labels, value) for (metric, labels), value in values.items() if metric == name)
+        if not samples:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if kind != "histogram":
+                lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            buckets, counts, total = value[0], value[1:-1], value[-1]
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+def _endpoint() -> tuple:
+    """Returns the endpoint label of the current request."""
+    return (("endpoint", request.endpoint or "<unmatched>"),)
+
+def _start():
+    """before_request hook, counts the request as in flight and starts its clock."""
+    inc("http_requests_in_flight", _endpoint())
+    g.metrics_start = time.perf_counter()
+
+def _status(response: object) -> object:
+    """after_request hook, remembers the status for the latency histogram."""
+    g.metrics_status = response.status_code
+    return response
+
+def _stop(error: object = None):
+    """teardown_request hook, records the latency once the body was sent and writes the snapshot when it's due."""
+    global _next_flush
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return
+    endpoint = _endpoint()
+    observe("http_request_duration_seconds", endpoint + (("status", str(g.get("metrics_status", 500))),),
+            time.perf_counter() - start)
+    inc("http_requests_in_flight", endpoint, -1)
+
+    if _metrics_dir() and time.monotonic() >= _next_flush and _flush_lock.acquire(blocking=False):
+        try:
+            _next_flush = time.monotonic() + METRICS_FLUSH_INTERVAL
+            flush()
+        except OSError as e:
+            print(f"Metrics flush error: {e}")
+        finally:
+            _flush_lock.release()
+
+def install(app: object):
+    """Registers the request metrics hooks on app."""
+    app.before_request(_start)
+    app.after_request(_status)
+    app.teardown_request(_stop)
+
+def _reset():
+    """Drops the values inherited from the parent in a forked worker, they're the parent's to report."""
+    global _local, _shards_lock, _flush_lock, _next_flush
+    _local = threading.local()
+    _shards_lock = threading.Lock()
+    _flush_lock = threading.Lock()
+    _next_flush = 0.0
+    _shards.clear()
+    _retired.clear()
+
+def _flush_at_exit():
+    """Writes the final values of this process so its counters outlive it."""
+    if _metrics_dir():
+        flush()
+
+os.register_at_fork(after_in_child=_reset)
+atexit.register(_flush_at_exit)
@@ -1,24 +1,102 @@
-from google.cloud import datastore
+import hashlib
+import random
+import time
+from helpers.import_helpers import lazy_import
+import helpers.client_helpers as client_helpers
+import helpers.entity_cache_helpers as entity_cache_helpers
+from constants import TRANSACTION_RETRIES, TRANSACTION_BACKOFF_BASE, TRANSACTION_BACKOFF_MAX, DATASTORE_MAX_BATCH
 
-# Datastore client to interact with database.
-client = datastore.Client()
+exceptions = lazy_import("google.api_core.exceptions")
+
+# Datastore client to interact with database, shared by every model.
+client = client_helpers.client
 
 def count_items_in_kind(name: str, user: str) -> int:
-    """Returns the total numbers of items in datastore collection based on name. Also filters by user if airplane type."""
+    """Returns the total numbers of items in datastore collection based on name. Also filters by user if airplane type.
+    Counts server side with a COUNT aggregation query, falls back to counting keys if aggregation is unavailable."""
     query = client.query(kind=name)
-    results = list(query.fetch())
+    if user: query.add_filter("pilot", "=", user) # If user passed only count airplanes of passed user.
     
-    # If user passed filter airplanes to only include those of passed user.
-    if user: results = [airplane for airplane in results if airplane["pilot"] == user]
-    return len(results)
+    try:
+        aggregation_query = client.aggregation_query(query).count(alias="total")
+        for results in aggregation_query.fetch(): # Single result row holding the count.
+            for result in results:
+                if result.alias == "total": return result.value
+        return 0
+    except exceptions.GoogleAPICallError: # Backend without aggregation support, e.g. an old emulator.
+        query.keys_only()
+        return sum(1 for _ in query.fetch())
+
+def allocate_keys(kind: str, count: int) -> list:
+    """Returns count new complete keys of kind, allocated in as few allocate_ids calls as Datastore allows."""
+    keys = []
+    while len(keys) < count:
+        keys += client.allocate_ids(client.key(kind), min(count - len(keys), DATASTORE_MAX_BATCH))
+    return keys
+
+def run_in_transaction(function: object, *args) -> object:
+    """Calls function with args inside a Datastore transaction and returns its result. If the commit is aborted by
+    contention the whole function is retried with jittered exponential backoff, up to TRANSACTION_RETRIES times."""
+    for attempt in range(TRANSACTION_RETRIES + 1):
+        try:
+            entity_cache_helpers.begin()
+            with client.transaction(): # Commits when leaving the with block.
+                result = function(*args)
+            entity_cache_helpers.commit() # Refresh the entity cache with what was written.
+            return result
+        except exceptions.Conflict: # Aborted by a concurrent transaction on the same entities.
+            if attempt == TRANSACTION_RETRIES:
+                raise
+            time.sleep(random.uniform(0, min(TRANSACTION_BACKOFF_MAX, TRANSACTION_BACKOFF_BASE * 2 ** attempt)))
+
+def put_multi(entities: list):
+    """Stamps each entity with its next version and writes them. Must be called inside run_in_transaction, the entity
+    cache is refreshed once the transaction commits."""
+    for entity in entities:
+        entity["version"] = _version(entity, 0) + 1
+    client.put_multi(entities)
+    entity_cache_helpers.stage_put(entities)
+
+def delete_multi(entities: list):
+    """Deletes the entities. Must be called inside run_in_transaction, the entity cache drops them once the transaction
+    commits."""
+    client.delete_multi([entity.key for entity in entities])
+    entity_cache_helpers.stage_delete(entities)
+
+def _version(entity: object, default: int = None) -> int:
+    """Returns the version the entity was written with, also once hide_internal moved it out of its properties."""
+    return entity.get("version", getattr(entity, "version", default))
+
+def hide_internal(entity: object):
+    """Moves the properties only the app uses out of an entity that's returned to clients. The version is kept as an
+    attribute, entity_etag still reads it."""
+    if "version" in entity:
+        entity.version = entity.pop("version")
+
+def entity_etag(entity: object) -> str:
+    """Returns a strong ETag for the entity, derived from its version, or from last_update for entities written before
+    versions existed."""
+    version = _version(entity)
+    if version is not None:
+        stamp = "v" + str(version)
+    elif entity.get("last_update"):
+        stamp = entity["last_update"].isoformat()
+    else: # No stamp at all, fall back to the stored content.
+        stamp = repr(sorted((name, value) for name, value in entity.items() if name not in ("id", "self")))
+    tag = hashlib.sha256("/".join([*map(str, entity.key.flat_path), stamp]).encode()).hexdigest()[:20]
+    return '"' + tag + '"'
+
+def etag_matches(entity: object, expected_etags: set) -> bool:
+    """Returns True if no ETags were expected or the entity's ETag is one of them."""
+    return expected_etags is None or entity_etag(entity) in expected_etags
 
 def enough_capacity_left(airplane: object, cargo: object) -> bool:
     """Receives the the airplane and cargo that wants to be added and checks if there's enough capacity to add the cargo.
     Returns True if there is and False if not."""
     cargos = airplane["cargo"]
     total = 0
-    for cargo in cargos:
-        total += cargo["weight"]
+    for loaded in cargos: # Don't shadow the cargo being added.
+        total += loaded["weight"]
     
     if total + cargo["weight"] > airplane["capacity"]: return False
     else: return True
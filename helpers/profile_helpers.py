@@ -0,0 +1,153 @@
+import cProfile
+import os
+import pstats
+import random
+import sysconfig
+import threading
+import time
+from collections import Counter
+from flask import g, request
+from helpers.controler_helpers import is_admin_request
+from constants import PROFILE_SAMPLE_RATE, PROFILE_HEADER, PROFILE_TOP_FUNCTIONS
+
+# Opt-in cProfile of selected requests, merged per endpoint. A request is profiled if it's sampled or an admin asked
+# for it with the header. One request is profiled at a time, the others run normally, which bounds the overhead and
+# avoids clashing profilers. The profile stops when the request context is torn down, after a streamed body was sent.
+
+# Time of each function is attributed to the first category whose path fragment its file contains. Built-in and
+# standard library functions are attributed to the category that calls them the most.
+CATEGORIES = [
+    ("jwt", ["/jose/", "/rsa/", "/ecdsa/", "/cryptography/", "/pyasn1/", "jwks_helpers.py", "token_helpers.py"]),
+    ("datastore", ["/google/cloud/", "/google/api_core/", "/grpc/", "/proto/", "/google/protobuf/", "memory_helpers.py",
+                   "client_helpers.py"]),
+    ("serialization", ["/json/", "/orjson", "json_helpers.py", "stream_helpers.py"]),
+    ("framework", ["/flask/", "/werkzeug/", "/jinja2/", "/markupsafe/"]),
+    ("app", ["/models/", "/controllers/", "/helpers/"]),
+]
+
+STDLIB = sysconfig.get_paths()["stdlib"].replace("\\", "/")
+
+_lock = threading.Lock()
+_profiling = threading.Lock() # Held while a request is being profiled.
+_endpoints = {} # Endpoint to {"requests", "wall", "stats"}.
+_disabled = False # Set by servers running views off the request's thread, where cProfile would miss them.
+
+def _sample_rate() -> float:
+    """Returns the configured sample rate, the environment variable overrides constants.py."""
+    return float(os.environ.get("PROFILE_SAMPLE_RATE", PROFILE_SAMPLE_RATE))
+
+def _wanted() -> bool:
+    """Returns True if the current request should be profiled."""
+    rate = _sample_rate()
+    if rate > 0 and random.random() < rate:
+        return True
+    return request.headers.get(PROFILE_HEADER) == "1" and is_admin_request(request)
+
+def _start():
+    """before_request hook, starts profiling the request if wanted and no other request is profiled."""
+    if _disabled or not _wanted() or not _profiling.acquire(blocking=False):
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError: # Another profiler is active in this interpreter.
+        _profiling.release()
+        return
+    g.profile = (profile, time.perf_counter())
+
+def _stop(error: object = None):
+    """teardown_request hook, stops the profile and merges it into its endpoint's stats."""
+    started = g.pop("profile", None)
+    if started is None:
+        return
+    profile, start = started
+    profile.disable()
+    _profiling.release()
+    wall = time.perf_counter() - start
+
+    endpoint = request.endpoint or "<unmatched>"
+    with _lock:
+        entry = _endpoints.get(endpoint)
+        if entry is None:
+            _endpoints[endpoint] = {"requests": 1, "wall": wall, "stats": pstats.Stats(profile)}
+        else:
+            entry["requests"] += 1
+            entry["wall"] += wall
+            entry["stats"].add(profile)
+
+def install(app: object):
+    """Registers the profiling hooks on app."""
+    app.before_request(_start)
+    app.teardown_request(_stop)
+
+def disable(app: object, reason: str):
+    """Turns request profiling off in this process. cProfile only sees the thread it was enabled on, the hooks run
+    on the request's thread, so a server running the view on another thread would get profiles without it."""
+    global _disabled
+    _disabled = True
+    app.logger.warning(f"Request profiling is off, {reason}")
+
+def _file_category(filename: str) -> str:
+    """Returns the category of a source file, None for built-in functions and the rest of the standard library."""
+    filename = filename.replace("\\", "/")
+    if filename == "~":
+        return None
+    for name, fragments in CATEGORIES:
+        if any(fragment in filename for fragment in fragments):
+            return name
+    return None if filename.startswith(STDLIB) and "/site-packages/" not in filename else "other"
+
+def _caller_category(function: tuple, stats: pstats.Stats) -> str:
+    """Returns the category that called a built-in or standard library function the most, walking up through other
+    built-in and standard library callers, e.g. from deepcopy to the module that started copying."""
+    frontier, seen, weights = [function], {function}, Counter()
+    while frontier:
+        for caller, values in stats.stats.get(frontier.pop(), (0, 0, 0, 0, {}))[4].items():
+            category = _file_category(caller[0])
+            if category is not None:
+                weights[category] += values[3] # Cumulative time of the calls from this caller.
+            elif caller not in seen:
+                seen.add(caller)
+                frontier.append(caller)
+    return weights.most_common(1)[0][0] if weights else "other"
+
+def _categories(stats: pstats.Stats) -> dict:
+    """Returns the own time in seconds spent in each category."""
+    totals = {name: 0.0 for name, _ in CATEGORIES}
+    totals["other"] = 0.0
+    for function, (_, _, own_time, _, _) in stats.stats.items():
+        category = _file_category(function[0]) or _caller_category(function, stats)
+        totals[category] += own_time
+    return totals
+
+def _top_functions(stats: pstats.Stats, sort: str, count: int) -> list:
+    """Returns the count functions with the most own time, or cumulative time if sort is "cumulative"."""
+    index = 3 if sort == "cumulative" else 2
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][index], reverse=True)[:count]
+    return [{"function": f"{filename}:{line}({name})", "calls": calls, "own_ms": round(own_time * 1000, 3),
+             "cumulative_ms": round(cumulative * 1000, 3)}
+            for (filename, line, name), (_, calls, own_time, cumulative, _) in rows]
+
+def get_report(endpoint: str = None, sort: str = "own", count: int = PROFILE_TOP_FUNCTIONS) -> dict:
+    """Returns the merged profile of every endpoint, or only of endpoint if passed. Wall and category times are per
+    request averages in milliseconds, function times are the totals of the top count functions over every request."""
+    with _lock:
+        report = {}
+        for name, entry in sorted(_endpoints.items()):
+            if endpoint not in (None, name):
+                continue
+            requests = entry["requests"]
+            categories = _categories(entry["stats"])
+            report[name] = {
+                "requests": requests,
+                "wall_ms": round(entry["wall"] * 1000 / requests, 3),
+                "categories_ms": {category: round(seconds * 1000 / requests, 3)
+                                  for category, seconds in categories.items()},
+                "functions": _top_functions(entry["stats"], sort, count),
+            }
+    return report
+
+def reset():
+    """Drops every collected profile."""
+    with _lock:
+        _endpoints.clear()
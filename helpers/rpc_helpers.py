@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+from flask import current_app, g, has_request_context, request
+import helpers.metrics_helpers as metrics_helpers
+from constants import DATASTORE_RPC_DEBUG, DATASTORE_RPC_BUDGET, DATASTORE_RPC_BUDGETS, METRICS_RPC_BUCKETS
+
+# Datastore RPC instrumentation. InstrumentedClient wraps the shared client and times and counts every call, per
+# operation for the process and per request in flask.g. Puts and deletes inside a transaction are only buffered, they
+# count as calls and entities but the RPC is the commit. Wire sizes aren't exposed by the client library, so only
+# entity counts are recorded. RPCs made while a streamed body is written come after the Server-Timing header was sent,
+# they still count for the budget and the stats.
+
+_lock = threading.Lock()
+_operations = {} # Operation to {"calls", "rpcs", "seconds", "entities", "errors"}.
+_endpoints = {} # Endpoint to {"requests", "rpcs", "max_rpcs", "over_budget"}.
+
+def _debug() -> bool:
+    """Returns True if over budget requests are logged, the environment variable overrides constants.py."""
+    return os.environ.get("DATASTORE_RPC_DEBUG", "1" if DATASTORE_RPC_DEBUG else "0") == "1"
+
+def _record(operation: str, seconds: float, entities: int, rpc: bool = True, error: bool = False):
+    """Adds a call to the process totals and, inside a request, to the request's totals."""
+    with _lock:
+        totals = _operations.setdefault(operation, {"calls": 0, "rpcs": 0, "seconds": 0.0, "entities": 0, "errors": 0})
+        totals["calls"] += 1
+        totals["rpcs"] += rpc
+        totals["seconds"] += seconds
+        totals["entities"] += entities
+        totals["errors"] += error
+    if rpc:
+        labels = (("operation", operation),)
+        metrics_helpers.observe("datastore_rpc_duration_seconds", labels, seconds, METRICS_RPC_BUCKETS)
+        if error:
+            metrics_helpers.inc("datastore_rpc_errors_total", labels)
+    if has_request_context():
+        with _lock: # Async handlers run a request's RPCs in several threads at once.
+            calls = g.setdefault("datastore_rpcs", {})
+            current = calls.setdefault(operation, {"calls": 0, "rpcs": 0, "seconds": 0.0, "entities": 0})
+            current["calls"] += 1
+            current["rpcs"] += rpc
+            current["seconds"] += seconds
+            current["entities"] += entities
+
+def _timed(operation: str, function: object, *args, entities: object = None, rpc: bool = True, **kwargs) -> object:
+    """Calls function and records it. entities is the number of entities sent, or a function returning the number
+    received from the result."""
+    start = time.perf_counter()
+    try:
+        result = function(*args, **kwargs)
+    except Exception:
+        _record(operation, time.perf_counter() - start, 0, rpc, error=True)
+        raise
+    count = entities(result) if callable(entities) else entities or 0
+    _record(operation, time.perf_counter() - start, count, rpc)
+    return result
+
+class InstrumentedClient:
+    """Datastore client wrapper recording every RPC, anything not instrumented is passed through."""
+
+    def __init__(self, client: object):
+        self._client = client
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _buffered(self) -> bool:
+        """Returns True if writes are buffered by a running transaction."""
+        return self._client.current_batch is not None
+
+    def get(self, key: object, *args, **kwargs) -> object:
+        return _timed("get", self._client.get, key, *args, entities=lambda entity: int(entity is not None), **kwargs)
+
+    def get_multi(self, keys: list, *args, **kwargs) -> list:
+        return _timed("get_multi", self._client.get_multi, keys, *args, entities=len, **kwargs)
+
+    def put(self, entity: object, *args, **kwargs):
+        return _timed("put", self._client.put, entity, *args, entities=1, rpc=not self._buffered(), **kwargs)
+
+    def put_multi(self, entities: list, *args, **kwargs):
+        return _timed("put_multi", self._client.put_multi, entities, *args, entities=len(entities),
+                      rpc=not self._buffered(), **kwargs)
+
+    def delete(self, key: object, *args, **kwargs):
+        return _timed("delete", self._client.delete, key, *args, entities=1, rpc=not self._buffered(), **kwargs)
+
+    def delete_multi(self, keys: list, *args, **kwargs):
+        return _timed("delete_multi", self._client.delete_multi, keys, *args, entities=len(keys),
+                      rpc=not self._buffered(), **kwargs)
+
+    def allocate_ids(self, incomplete_key: object, num_ids: int, *args, **kwargs) -> list:
+        return _timed("allocate_ids", self._client.allocate_ids, incomplete_key, num_ids, *args, entities=num_ids,
+                      **kwargs)
+
+    def transaction(self, *args, **kwargs) -> object:
+        return _Transaction(self._client.transaction(*args, **kwargs))
+
+    def query(self, *args, **kwargs) -> object:
+        return _Query(self._client.query(*args, **kwargs))
+
+    def aggregation_query(self, query: object, *args, **kwargs) -> object:
+        query = query._query if isinstance(query, _Query) else query
+        return _AggregationQuery(self._client.aggregation_query(query, *args, **kwargs))
+
+class _Transaction:
+    """Transaction wrapper recording the begin and the commit or rollback."""
+
+    def __init__(self, transaction: object):
+        self._transaction = transaction
+
+    def __getattr__(self, name):
+        return getattr(self._transaction, name)
+
+    def __enter__(self):
+        _timed("begin", self._transaction.__enter__)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        operation = "commit" if exc_type is None else "rollback"
+        mutations = len(self._transaction.mutations) if exc_type is None else 0
+        return _timed(operation, self._transaction.__exit__, exc_type, exc_value, traceback, entities=mutations)
+
+class _Query:
+    """Query wrapper whose fetch returns a recording iterator, attributes are read and set on the wrapped query."""
+
+    def __init__(self, query: object):
+        object.__setattr__(self, "_query", query)
+
+    def __getattr__(self, name):
+        return getattr(self._query, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._query, name, value)
+
+    def fetch(self, *args, **kwargs) -> object:
+        return _Iterator(self._query.fetch(*args, **kwargs))
+
+class _Iterator:
+    """Query iterator wrapper recording the RPC of every page."""
+
+    def __init__(self, iterator: object):
+        self._iterator = iterator
+
+    def __getattr__(self, name):
+        return getattr(self._iterator, name)
+
+    @property
+    def pages(self) -> object:
+        pages = self._iterator.pages
+        while True:
+            start = time.perf_counter()
+            try:
+                page = list(next(pages))
+            except StopIteration:
+                return
+            except Exception:
+                _record("query", time.perf_counter() - start, 0, error=True)
+                raise
+            _record("query", time.perf_counter() - start, len(page))
+            yield iter(page)
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+class _AggregationQuery:
+    """Aggregation query wrapper recording the RPC of its fetch."""
+
+    def __init__(self, aggregation_query: object):
+        self._aggregation_query = aggregation_query
+
+    def __getattr__(self, name):
+        attribute = getattr(self._aggregation_query, name)
+        if name in ("count", "sum", "avg"): # Builders return the query, keep returning the wrapper.
+            return lambda *args, **kwargs: attribute(*args, **kwargs) and self
+        return attribute
+
+    def fetch(self, *args, **kwargs) -> object:
+        yield from _timed("aggregation", lambda: list(self._aggregation_query.fetch(*args, **kwargs)))
+
+def _server_timing(response: object) -> object:
+    """after_request hook, adds the request's Datastore time per operation as a Server-Timing header."""
+    calls = g.get("datastore_rpcs")
+    if calls:
+        rpcs = sum(current["rpcs"] for current in calls.values())
+        seconds = sum(current["seconds"] for current in calls.values())
+        timings = [f'datastore;dur={seconds * 1000:.2f};desc="{rpcs} rpcs"']
+        timings += [f'ds-{operation.replace("_", "-")};dur={current["seconds"] * 1000:.2f};desc="{current["calls"]} calls"'
+                    for operation, current in calls.items()]
+        response.headers.add("Server-Timing", ", ".join(timings))
+    return response
+
+def _check_budget(error: object = None):
+    """teardown_request hook, adds the request to its endpoint's totals and in debug mode logs a warning if it made
+    more RPCs than the endpoint's budget."""
+    calls = g.get("datastore_rpcs", {})
+    rpcs = sum(current["rpcs"] for current in calls.values())
+    endpoint = request.endpoint or "<unmatched>"
+    budget = DATASTORE_RPC_BUDGETS.get(endpoint, DATASTORE_RPC_BUDGET)
+    with _lock:
+        totals = _endpoints.setdefault(endpoint, {"requests": 0, "rpcs": 0, "max_rpcs": 0, "over_budget": 0})
+        totals["requests"] += 1
+        totals["rpcs"] += rpcs
+        totals["max_rpcs"] = max(totals["max_rpcs"], rpcs)
+        totals["over_budget"] += rpcs > budget
+
+    if rpcs > budget and _debug():
+        breakdown = ", ".join(f"{operation} x{current['calls']}" for operation, current in calls.items())
+        current_app.logger.warning(f"{request.method} {request.path} ({endpoint}) made {rpcs} Datastore RPCs, over its "
+                                   f"budget of {budget}: {breakdown}")
+
+def install(app: object):
+    """Registers the Server-Timing and budget hooks on app."""
+    app.after_request(_server_timing)
+    app.teardown_request(_check_budget)
+
+def get_stats() -> dict:
+    """Returns the totals per operation and per endpoint, times in milliseconds."""
+    with _lock:
+        operations = {}
+        for operation, totals in _operations.items():
+            operations[operation] = {name: value for name, value in totals.items() if name != "seconds"}
+            operations[operation]["ms"] = round(totals["seconds"] * 1000, 3)
+        endpoints = {endpoint: dict(totals, avg_rpcs=round(totals["rpcs"] / totals["requests"], 2))
+                     for endpoint, totals in _endpoints.items()}
+    return {"operations": operations, "endpoints": endpoints}
@@ -0,0 +1,44 @@
+from flask import Response, current_app, stream_with_context
+
+# Chunked list responses. Entities are serialised one at a time as the generator producing them is consumed, the
+# envelope fields that are only known at the end (total, next) are written last.
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+
+def list_response_type(request:object) -> str:
+    """Returns the list format the client accepts, JSON or NDJSON, or None if neither."""
+    accept = request.headers.get("Accept")
+    return accept if accept in (JSON, NDJSON) else None
+
+def _json_chunks(list_name: str, items: object, envelope: object) -> object:
+    """Yields {"<list_name>": [items...], <envelope fields>} piece by piece."""
+    dumps = current_app.json.dumps
+    yield "{" + dumps(list_name) + ": ["
+    for i, item in enumerate(items):
+        yield (", " if i else "") + dumps(item)
+    yield "]"
+    for name, value in envelope().items():
+        yield ", " + dumps(name) + ": " + dumps(value)
+    yield "}"
+
+def _ndjson_chunks(items: object, envelope: object) -> object:
+    """Yields one line per item followed by a last line holding the envelope fields."""
+    dumps = current_app.json.dumps
+    for item in items:
+        yield dumps(item) + "\n"
+    yield dumps(envelope()) + "\n"
+
+def _chunks(mimetype: str, list_name: str, items: object, envelope: object) -> object:
+    """Returns the chunk generator of the passed format."""
+    if mimetype == NDJSON:
+        return _ndjson_chunks(items, envelope)
+    return _json_chunks(list_name, items, envelope)
+
+def stream_list(mimetype: str, list_name: str, items: object, envelope: object) -> Response:
+    """Returns a streamed response of items in the passed format. envelope is called once items is exhausted and
+    returns the fields to write after the list."""
+    return Response(stream_with_context(_chunks(mimetype, list_name, items, envelope)), mimetype=mimetype)
+
+def render_list(mimetype: str, list_name: str, items: object, envelope: object) -> Response:
+    """Same body as stream_list but built up front, for async handlers that already awaited every RPC of the page."""
+    return Response("".join(_chunks(mimetype, list_name, items, envelope)), mimetype=mimetype)
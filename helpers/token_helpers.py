@@ -0,0 +1,43 @@
+import hashlib
+import time
+from helpers.cache_helpers import TTLCache
+from constants import TOKEN_CACHE_SIZE, TOKEN_NEGATIVE_CACHE_SIZE, TOKEN_NEGATIVE_CACHE_TTL
+
+# Errors that will never change for the same token, safe to remember. "Incorrect claims" isn't, python-jose also
+# raises it for a token whose nbf or iat is still in the future, which becomes valid later.
+CACHEABLE_ERRORS = {"Invalid header", "Token expired", "Unable to parse authentication"}
+
+# Verified payloads expire with the token, rejected tokens are remembered for a short while.
+_verified = TTLCache(TOKEN_CACHE_SIZE)
+_rejected = TTLCache(TOKEN_NEGATIVE_CACHE_SIZE)
+
+def token_hash(token: str) -> str:
+    """Returns the hash used as cache key, so raw tokens are never kept in memory by the cache."""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def get_cached(token_key: str) -> dict:
+    """Receives a token hash and returns a copy of the cached payload or error dict, or None if not cached."""
+    payload = _verified.get(token_key)
+    if payload is not None:
+        return dict(payload)
+
+    error = _rejected.get(token_key)
+    if error is not None:
+        return dict(error)
+    return None
+
+def cache_result(token_key: str, result: dict):
+    """Receives a token hash and the result of verify_jwt and caches it. Payloads are kept until the token's exp,
+    errors only if they're in CACHEABLE_ERRORS."""
+    if "Error" in result:
+        if result["Error"] in CACHEABLE_ERRORS:
+            _rejected.set(token_key, dict(result), time.time() + TOKEN_NEGATIVE_CACHE_TTL)
+        return
+
+    exp = result.get("exp")
+    if isinstance(exp, (int, float)) and exp > time.time(): # Only tokens that expire are cached.
+        _verified.set(token_key, dict(result), exp)
+
+def get_stats() -> dict:
+    """Returns the counters of the verified and rejected token caches."""
+    return {"verified": _verified.stats(), "rejected": _rejected.stats()}
@@ -3,34 +3,78 @@ from flask import redirect
 from flask import render_template
 from flask import session
 from flask import url_for
-from authlib.integrations.flask_client import OAuth
+from flask import jsonify
+from flask import Response
+import threading
 from urllib.parse import urlencode
 from controllers.airplane_controller import airplane_bp
 from controllers.cargo_controller import cargo_bp
 from controllers.user_controller import user_bp
+from controllers.admin_controller import admin_bp
 import models.user_model as user_model
+import helpers.client_helpers as client_helpers
+import helpers.import_helpers as import_helpers
+import helpers.jwks_helpers as jwks_helpers
+import helpers.profile_helpers as profile_helpers
+import helpers.rpc_helpers as rpc_helpers
+import helpers.metrics_helpers as metrics_helpers
+from helpers.json_helpers import FastJSONProvider
 from constants import CLIENT_ID, CLIENT_SECRET, DOMAIN
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app) # Encodes entities, keys and dates, with orjson if installed.
 
 app.register_blueprint(airplane_bp)
 app.register_blueprint(cargo_bp)
 app.register_blueprint(user_bp)
+app.register_blueprint(admin_bp)
 app.secret_key = 'SECRET_KEY'
+profile_helpers.install(app) # Profiles sampled requests and those an admin asks for, see /admin/profiles.
+metrics_helpers.install(app) # Latency and in-flight metrics, served at /metrics.
+rpc_helpers.install(app) # Server-Timing header of the Datastore RPCs, warns of requests over their RPC budget.
 
-oauth = OAuth(app)
-auth0 = oauth.register(
-    'auth0',
-    client_id=CLIENT_ID,
-    client_secret=CLIENT_SECRET,
-    api_base_url="https://" + DOMAIN,
-    access_token_url="https://" + DOMAIN + "/oauth/token",
-    authorize_url="https://" + DOMAIN + "/authorize",
-    client_kwargs={
-        'scope': 'openid profile email',
-    },
-    server_metadata_url=f'https://{DOMAIN}/.well-known/openid-configuration'
-)
+# Auth0 OAuth client, registered on first use since authlib is slow to import. Only the login routes need it.
+_auth0 = None
+_auth0_lock = threading.Lock()
+
+def get_auth0() -> object:
+    """Returns the Auth0 OAuth client, registering it the first time it's needed."""
+    global _auth0
+    if _auth0 is None:
+        with _auth0_lock:
+            if _auth0 is None: # Another thread may have registered it while we waited.
+                from authlib.integrations.flask_client import OAuth
+                oauth = OAuth(app)
+                _auth0 = oauth.register(
+                    'auth0',
+                    client_id=CLIENT_ID,
+                    client_secret=CLIENT_SECRET,
+                    api_base_url="https://" + DOMAIN,
+                    access_token_url="https://" + DOMAIN + "/oauth/token",
+                    authorize_url="https://" + DOMAIN + "/authorize",
+                    client_kwargs={
+                        'scope': 'openid profile email',
+                    },
+                    server_metadata_url=f'https://{DOMAIN}/.well-known/openid-configuration'
+                )
+    return _auth0
+
+def warm_up() -> dict:
+    """Imports the lazily imported modules and builds what the first requests would otherwise wait for, the Datastore
+    channel, the JWKS keys and the OAuth client with its metadata. Returns the status of each."""
+    import_helpers.load_all()
+    status = client_helpers.health_check()
+    try:
+        jwks_helpers.refresh_keys()
+        status["jwks"] = "ok"
+    except Exception as e:
+        status["jwks"] = f"error: {e}"
+    try:
+        get_auth0().load_server_metadata()
+        status["oauth"] = "ok"
+    except Exception as e:
+        status["oauth"] = f"error: {e}"
+    return status
 
 # Basic route for whole app.
 @app.route('/')
@@ -38,17 +82,33 @@ def index():
     
     return render_template("welcome.html")
 
+# Health check route, verifies Datastore is reachable.
+@app.route("/healthz")
+def healthz():
+    status = client_helpers.health_check()
+    return jsonify(status), 200 if status["datastore"] == "ok" else 503
+
+# Metrics route, Prometheus text format summed over every worker process.
+@app.route("/metrics")
+def metrics():
+    return Response(metrics_helpers.render(), mimetype="text/plain; version=0.0.4")
+
+# Warmup route, App Engine sends it before routing traffic to a new instance (inbound_services in app.yaml).
+@app.route("/_ah/warmup")
+def warmup():
+    return jsonify(warm_up()), 200
+
 # Login to Auth0 route.
 @app.route("/login")
 def login():
-    return oauth.auth0.authorize_redirect(redirect_uri=url_for("callback", _external=True))
+    return get_auth0().authorize_redirect(redirect_uri=url_for("callback", _external=True))
 
 # Callback route.
 @app.route("/callback")
 def callback():
     try:
         # Process Auth0 callback as usual.
-        token = oauth.auth0.authorize_access_token()
+        token = get_auth0().authorize_access_token()
         session["jwt"] = token["id_token"]
         session["sub"] = token["userinfo"]["sub"]
         
@@ -66,8 +126,7 @@ def user_info():
     if not jwt or not sub: # If error.
         return "JWT or sub not found please login first", 401
     
-    if not user_model.user_exists(sub): # Create new user if user matching sub doesn't exist.
-        user_model.create_user(sub)
+    user_model.ensure_user(sub) # Create new user if user matching sub doesn't exist.
         
     return f"ID: {sub}<br>JWT: {jwt}"
 
@@ -76,7 +135,7 @@ def user_info():
 def logout():
     session.clear()
     params = {"returnTo": url_for("index", _extrenal=True), "client_id": CLIENT_ID}
-    return redirect(auth0.api_base_url + '/v2/logout?' + urlencode(params))
+    return redirect("https://" + DOMAIN + '/v2/logout?' + urlencode(params))
 
 if __name__ == '__main__':
     app.run(host='127.0.0.1', port=8080, debug=True)
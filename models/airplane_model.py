@@ -1,26 +1,45 @@
-from google.cloud import datastore
+from helpers.import_helpers import lazy_import
+import helpers.client_helpers as client_helpers
 import helpers.model_helpers as model_helpers
-import models.cargo_model as cargo_model
+import helpers.counter_helpers as counter_helpers
+import helpers.cursor_helpers as cursor_helpers
+import helpers.entity_cache_helpers as entity_cache_helpers
+from datetime import datetime
+from constants import EXACT_TOTALS
 
-# Datastore client to interact with database.
-client = datastore.Client()
+datastore = lazy_import("google.cloud.datastore")
+
+# Datastore client to interact with database, shared by every model.
+client = client_helpers.client
 
 def create_airplane(base_url: str, tail_number: str, type: str, capacity: str, user: str) -> tuple:
     """Creates new airplane on datastore based on passed attributes."""
-    key = client.key("Airplane")
-    new_airplane = datastore.Entity(key)
+    return create_airplanes(base_url, [(tail_number, type, capacity)], user)[0], 201
+
+def create_airplanes(base_url: str, airplanes: list, user: str) -> list:
+    """Receives a list of (tail_number, type, capacity) and creates every airplane on datastore for the pilot. Ids are
+    allocated up front in bulk and the airplanes are written and counted in chunks. Returns the new airplanes in the
+    same order."""
+    keys = model_helpers.allocate_keys("Airplane", len(airplanes))
+    new_airplanes = []
+    for key, (tail_number, type, capacity) in zip(keys, airplanes):
+        new_airplane = datastore.Entity(key)
+        new_airplane.update({"tail_number": tail_number, "type": type, "capacity": capacity, "cargo": [], "pilot": user,
+                             "last_update": datetime.now()})
+        new_airplanes.append(new_airplane)
     
-    new_airplane.update({"tail_number": tail_number, "type": type, "capacity": capacity, "cargo": [], "pilot": user})
-    client.put(new_airplane)
-    new_airplane["id"] = new_airplane.key.id # Add Id so it's returned.
-    new_airplane["self"] = base_url + "/" + str(new_airplane.key.id) # Build url to self and add to json.
-    return new_airplane, 201
+    counter_helpers.put_counted(client, "Airplane", user, new_airplanes) # Store the airplanes and count them atomically.
+    for new_airplane in new_airplanes:
+        new_airplane["id"] = new_airplane.key.id # Add Id so it's returned.
+        model_helpers.hide_internal(new_airplane)
+        new_airplane["self"] = base_url + "/" + str(new_airplane.key.id) # Build url to self and add to json.
+    return new_airplanes
 
 def get_airplane(base_url: str, id: str, user: str) -> tuple:
     """Receives the base_url airplane_id and pilot and gets the airplne from datastore. If airplane does not exist or
     user does not have access to it an error is returned."""
     key = client.key("Airplane", int(id))
-    airplane = client.get(key)
+    airplane = entity_cache_helpers.get(key) # Read through the entity cache.
     
     if not airplane: # Airplane not found.
         return False, {"Error": "Airplane with airplane_id not found."}, 404
@@ -28,6 +47,7 @@ def get_airplane(base_url: str, id: str, user: str) -> tuple:
         return False, {"Error": "User does not have access to the airplane."}, 401
         
     airplane["id"] = airplane.key.id
+    model_helpers.hide_internal(airplane)
     airplane["self"] = base_url
      
     if airplane["cargo"]: # If loaded create self for each cargo.
@@ -37,64 +57,103 @@ def get_airplane(base_url: str, id: str, user: str) -> tuple:
     
     return True, airplane, 200
     
-def get_airplanes(base_url: str, q_limit: str, q_offset: str, user: str) -> dict:
+def get_airplanes(base_url: str, q_limit: str, q_offset: str, user: str, cursor: bytes = None) -> dict:
     """Function returns all airplanes from google datastore owned by this user, in groups of 5 by using pagination along 
-    with the next url."""
+    with the next url. Pages start at cursor if passed, otherwise at q_offset which is the slow path since Datastore
+    reads and discards every skipped airplane."""
+    airplanes, envelope = list_airplanes(base_url, q_limit, q_offset, user, cursor)
+    response = {"airplanes": list(airplanes)} # List of airplanes.
+    response.update(envelope())
+    return response
+
+def list_airplanes(base_url: str, q_limit: str, q_offset: str, user: str, cursor: bytes = None) -> tuple:
+    """Same page as get_airplanes but for streaming, returns a generator yielding each airplane as it's read off the
+    query page and a function returning the total and next url, to call once the generator is exhausted. Without a
+    total passed it reads the counter, streaming callers count first so the RPC isn't made after the 200 was sent."""
     query = client.query(kind="Airplane")
     query.add_filter("pilot", '=', user)
-    l_iterator = query.fetch(limit=int(q_limit), offset=int(q_offset))
-    pages = l_iterator.pages
-    results = list(next(pages)) # Fetch result of query in list form
-    
-    if l_iterator.next_page_token: # Create the next url using limit and offset.
-        next_offset = int(q_offset) + int(q_limit)
-        next_url = base_url + "?limit=" + q_limit + "&offset=" + str(next_offset)
+    query.order = ["__key__"] # Stable order across pages.
+    if cursor:
+        l_iterator = query.fetch(limit=int(q_limit), start_cursor=cursor)
     else:
-        next_url = None
+        l_iterator = query.fetch(limit=int(q_limit), offset=int(q_offset))
+    page = next(l_iterator.pages) # Run the query now so errors surface before the response starts.
     
-    for airplane in results: # Add id and self to all airplane objects.
-        airplane["id"] = airplane.key.id
-        airplane["self"] = base_url + "/" +str(airplane.key.id)
-        
-        if airplane["cargo"]:
-            for i in range(len(airplane["cargo"])): # If airplane has cargo construct self for each cargo.
-                parts = base_url.split("airplanes")
-                airplane["cargo"][i]["self"] = parts[0] + "cargo/" + str(airplane["cargo"][i]["id"])
+    def airplanes():
+        for airplane in page: # Add id and self to all airplane objects.
+            airplane["id"] = airplane.key.id
+            model_helpers.hide_internal(airplane)
+            airplane["self"] = base_url + "/" +str(airplane.key.id)
+            
+            if airplane["cargo"]:
+                for i in range(len(airplane["cargo"])): # If airplane has cargo construct self for each cargo.
+                    parts = base_url.split("airplanes")
+                    airplane["cargo"][i]["self"] = parts[0] + "cargo/" + str(airplane["cargo"][i]["id"])
+            yield airplane
     
-    total = model_helpers.count_items_in_kind("Airplane", user) # Get total number for user.
-    airplanes = [dict(airplane) for airplane in results] # List of airplanes.
-    response = {"airplanes": airplanes, "total": total, "next": next_url}
+    def envelope(total: int = None): # Total can be counted concurrently by the caller, otherwise it's read here.
+        if l_iterator.next_page_token: # Create the next url using limit and a signed cursor.
+            next_cursor = cursor_helpers.encode_cursor(l_iterator.next_page_token, cursor_helpers.scope("Airplane", user))
+            next_url = base_url + "?limit=" + q_limit + "&cursor=" + next_cursor
+        else:
+            next_url = None
+        
+        if total is None:
+            total = count_airplanes(user)
+        return {"total": total, "next": next_url}
     
-    return response
+    return airplanes(), envelope
 
-def update_airplane(base_url: str, caller: str, id: str, user: str, attributes: dict) -> tuple:
+def count_airplanes(user: str) -> int:
+    """Returns the user's number of airplanes, read from the sharded counter."""
+    return counter_helpers.get_total(client, "Airplane", user, EXACT_TOTALS) # Get total number for user.
+
+def update_airplane(base_url: str, caller: str, id: str, user: str, attributes: dict, if_match: set = None) -> tuple:
     """Receives the base url, caller, id , user and attributes to update and updates the airplanes attributes. If airplane 
-    doesn't exist or invalid user returns an error."""
+    doesn't exist or invalid user returns an error. If if_match passed the update only happens if the stored airplane
+    still has one of those ETags, otherwise returns code 412."""
     key = client.key("Airplane", int(id))
+    airplane, code = model_helpers.run_in_transaction(_update_airplane, key, user, attributes, if_match)
+    if code >= 400: # Error message.
+        return airplane, code
+    
+    airplane["id"] = airplane.key.id
+    model_helpers.hide_internal(airplane)
+    airplane["self"] = base_url
+    
+    if caller == "PATCH":
+        return airplane, 200 # PATCH success.
+    else:
+        return airplane, 303 # PUT success.
+
+def _update_airplane(key: object, user: str, attributes: dict, if_match: set) -> tuple:
+    """Transaction body of update_airplane, reads the airplane and writes the changed attributes."""
     airplane = client.get(key)
     
     if not airplane: # airplane_id not found.
         return {"Error": "No airplane with this airplane_id exists"}, 404
     if airplane["pilot"] != user: # User can't access airplane.
         return {"Error": "User does not have access to the airplane."}, 401
+    if not model_helpers.etag_matches(airplane, if_match): # Airplane changed since the client read it.
+        return {"Error": "The airplane was modified, fetch it again before updating"}, 412
     
     for attribute in list(attributes.keys()): # If attribute not passed or None passed, delete it prior to update.
         if attributes[attribute] == None:
             del attributes[attribute]
     
+    attributes.update({"last_update": datetime.now()})
     airplane.update(attributes)
-    client.put(airplane)
-    airplane["id"] = airplane.key.id
-    airplane["self"] = base_url
-    
-    if caller == "PATCH":
-        return airplane, 200 # PATCH success.
-    else:
-        return airplane, 303 # PUT success.
+    model_helpers.put_multi([airplane])
+    return airplane, 200
 
 def delete_airplane(id: str, user: str) -> tuple:
-    """Receives airplane id and user and deletes the airplane if it's the correct user."""
+    """Receives airplane id and user and deletes the airplane if it's the correct user. Runs in one transaction that
+    unloads every cargo with a single get_multi and put_multi, so the round trips don't grow with the cargo aboard."""
     key = client.key("Airplane", int(id))
+    return model_helpers.run_in_transaction(_delete_airplane, key, user)
+
+def _delete_airplane(key: object, user: str) -> tuple:
+    """Transaction body of delete_airplane, unloads the cargo, deletes the airplane and uncounts it."""
     airplane = client.get(key)
     
     if not airplane: # No airplane found.
@@ -103,8 +162,12 @@ def delete_airplane(id: str, user: str) -> tuple:
         return False, {"Error": "User does not have access to the airplane."}, 401
     
     if airplane["cargo"]: # Removes airplane as carrier for cargo that was being carried.
-        for i in range(len(airplane["cargo"])):
-            cargo_model.remove_cargo(id, str(airplane["cargo"][i]["id"]))
+        cargo_keys = [client.key("Cargo", cargo["id"]) for cargo in airplane["cargo"]]
+        cargos = [cargo for cargo in client.get_multi(cargo_keys) if cargo["carrier"] and cargo["carrier"]["id"] == key.id]
+        for cargo in cargos:
+            cargo.update({"carrier": None})
+        model_helpers.put_multi(cargos)
     
-    client.delete(key)
-    return True, "", 204
\ No newline at end of file
+    model_helpers.delete_multi([airplane])
+    counter_helpers.increment(client, "Airplane", user, -1)
+    return True, "", 204
@@ -1,30 +1,48 @@
-from google.cloud import datastore
+from helpers.import_helpers import lazy_import
+import helpers.client_helpers as client_helpers
 import helpers.model_helpers as model_helpers
+import helpers.counter_helpers as counter_helpers
+import helpers.cursor_helpers as cursor_helpers
+import helpers.entity_cache_helpers as entity_cache_helpers
 from datetime import datetime
+from constants import EXACT_TOTALS
 
-# Datastore client to interact with database.
-client = datastore.Client()
+datastore = lazy_import("google.cloud.datastore")
+
+# Datastore client to interact with database, shared by every model.
+client = client_helpers.client
 
 def create_cargo(base_url: str, weight: str, item: str)-> object:
     """Receives load info and creates it on google datastore."""
-    key = client.key("Cargo")
-    new_cargo = datastore.Entity(key)
+    return create_cargos(base_url, [(weight, item)])[0]
+
+def create_cargos(base_url: str, cargos: list)-> list:
+    """Receives a list of (weight, item) and creates every load on google datastore. Ids are allocated up front in bulk
+    and the loads are written and counted in chunks. Returns the new loads in the same order."""
+    keys = model_helpers.allocate_keys("Cargo", len(cargos))
+    new_cargos = []
+    for key, (weight, item) in zip(keys, cargos):
+        new_cargo = datastore.Entity(key)
+        new_cargo.update({"weight": weight, "carrier": None, "item": item, "last_update": datetime.now()})
+        new_cargos.append(new_cargo)
     
-    new_cargo.update({"weight": weight, "carrier": None, "item": item, "last_update": datetime.now()})
-    client.put(new_cargo)
-    new_cargo["id"] = new_cargo.key.id # Add Id so it's returned.
-    new_cargo["self"] = base_url + "/" +str(new_cargo.key.id) # Build url to self and add to json.
-    return new_cargo
+    counter_helpers.put_counted(client, "Cargo", None, new_cargos) # Store the loads and count them atomically.
+    for new_cargo in new_cargos:
+        new_cargo["id"] = new_cargo.key.id # Add Id so it's returned.
+        model_helpers.hide_internal(new_cargo)
+        new_cargo["self"] = base_url + "/" +str(new_cargo.key.id) # Build url to self and add to json.
+    return new_cargos
 
 def get_cargo(base_url: str, id: str)-> object:
     """Receives the base_url and id and returns the cargo information from google datastore."""
     key = client.key("Cargo", int(id))
-    cargo = client.get(key)
+    cargo = entity_cache_helpers.get(key) # Read through the entity cache.
     
     if not cargo: # If load not found.
         return None
     
     cargo["id"] = cargo.key.id
+    model_helpers.hide_internal(cargo)
     cargo["self"] = base_url
      
     if cargo["carrier"] is not None: # If cargo has a carrier construct self url to carrier.
@@ -33,40 +51,80 @@ def get_cargo(base_url: str, id: str)-> object:
     
     return cargo
 
-def get_cargos(base_url: str, q_limit: str, q_offset: str)-> dict:
-    """Function returns all loads from google datastore, in groups of 5 by using pagination along with the next url."""
+def get_cargos(base_url: str, q_limit: str, q_offset: str, cursor: bytes = None)-> dict:
+    """Function returns all loads from google datastore, in groups of 5 by using pagination along with the next url.
+    Pages start at cursor if passed, otherwise at q_offset which is the slow path since Datastore reads and discards
+    every skipped load."""
+    loads, envelope = list_cargos(base_url, q_limit, q_offset, cursor)
+    response = {"Cargos": list(loads)} # List of loads.
+    response.update(envelope())
+    return response
+
+def list_cargos(base_url: str, q_limit: str, q_offset: str, cursor: bytes = None) -> tuple:
+    """Same page as get_cargos but for streaming, returns a generator yielding each load as it's read off the query
+    page and a function returning the total and next url, to call once the generator is exhausted. The function
+    reads the counter unless given the total, so callers that stream pass one counted up front."""
     query = client.query(kind="Cargo")
-    l_iterator = query.fetch(limit=int(q_limit), offset=int(q_offset))
-    pages = l_iterator.pages
-    results = list(next(pages)) # Fetch result of query in list form
-    
-    if l_iterator.next_page_token: # Create the next url using limit and offset.
-        next_offset = int(q_offset) + int(q_limit)
-        next_url = base_url + "?limit=" + q_limit + "&offset=" + str(next_offset)
+    query.order = ["__key__"] # Stable order across pages.
+    if cursor:
+        l_iterator = query.fetch(limit=int(q_limit), start_cursor=cursor)
     else:
-        next_url = None
+        l_iterator = query.fetch(limit=int(q_limit), offset=int(q_offset))
+    page = next(l_iterator.pages) # Run the query now so errors surface before the response starts.
     
-    for cargo in results: # Add id and self to all cargo objects.
-        cargo["id"] = cargo.key.id
-        cargo["self"] = base_url + "/" +str(cargo.key.id)
-        
-        if cargo["carrier"] is not None: # If cargo has a carrier construct self url for carrier.
-            parts = base_url.split("loads")
-            cargo["carrier"]["self"] = parts[0] + "airplanes/" + str(cargo["carrier"]["id"])
+    def loads():
+        for cargo in page: # Add id and self to all cargo objects.
+            cargo["id"] = cargo.key.id
+            model_helpers.hide_internal(cargo)
+            cargo["self"] = base_url + "/" +str(cargo.key.id)
+            
+            if cargo["carrier"] is not None: # If cargo has a carrier construct self url for carrier.
+                parts = base_url.split("loads")
+                cargo["carrier"]["self"] = parts[0] + "airplanes/" + str(cargo["carrier"]["id"])
+            yield cargo
     
-    total = model_helpers.count_items_in_kind("Cargo", None) # Get total number, None for no user.
-    loads = [dict(load) for load in results] # List of loads.
-    response = {"Cargos": loads, "total": total, "next": next_url}
+    def envelope(total: int = None): # Passed if the caller already counted the loads.
+        if l_iterator.next_page_token: # Create the next url using limit and a signed cursor.
+            next_cursor = cursor_helpers.encode_cursor(l_iterator.next_page_token, cursor_helpers.scope("Cargo", None))
+            next_url = base_url + "?limit=" + q_limit + "&cursor=" + next_cursor
+        else:
+            next_url = None
+        
+        if total is None:
+            total = count_cargos()
+        return {"total": total, "next": next_url}
     
-    return response
+    return loads(), envelope
+
+def count_cargos() -> int:
+    """Returns the number of loads, read from the sharded counter."""
+    return counter_helpers.get_total(client, "Cargo", None, EXACT_TOTALS) # Get total number, None for no user.
 
-def update_cargo(base_url: str, caller: str, id: str, attributes: dict) -> tuple:
+def update_cargo(base_url: str, caller: str, id: str, attributes: dict, if_match: set = None) -> tuple:
     """Receives the base url, caller, id and attributes to update and updates the cargo attributes. If cargo doesn't exist
-    returns an error."""
+    returns an error. If if_match passed the update only happens if the stored cargo still has one of those ETags,
+    otherwise returns code 412."""
     key = client.key("Cargo", int(id))
+    cargo, code = model_helpers.run_in_transaction(_update_cargo, key, attributes, if_match)
+    if code >= 400: # Error message.
+        return cargo, code
+    
+    cargo["id"] = cargo.key.id
+    model_helpers.hide_internal(cargo)
+    cargo["self"] = base_url
+    
+    if caller == "PATCH":
+        return cargo, 200 # PATCH success
+    else:
+        return cargo, 303 # PUT success.
+
+def _update_cargo(key: object, attributes: dict, if_match: set) -> tuple:
+    """Transaction body of update_cargo, reads the cargo and writes the changed attributes."""
     cargo = client.get(key)
     if not cargo: # cargo_id not found.
         return {"Error": "No cargo with this cargo_id exists"}, 404
+    if not model_helpers.etag_matches(cargo, if_match): # Cargo changed since the client read it.
+        return {"Error": "The cargo was modified, fetch it again before updating"}, 412
     
     for attribute in list(attributes.keys()): # If attribute not passed or None passed, delete it prior to update.
         if attributes[attribute] == None:
@@ -74,14 +132,8 @@ def update_cargo(base_url: str, caller: str, id: str, attributes: dict) -> tuple
     
     attributes.update({"last_update": datetime.now()})
     cargo.update(attributes)
-    client.put(cargo)
-    cargo["id"] = cargo.key.id
-    cargo["self"] = base_url
-    
-    if caller == "PATCH":
-        return cargo, 200 # PATCH success
-    else:
-        return cargo, 303 # PUT success.
+    model_helpers.put_multi([cargo])
+    return cargo, 200
     
 def delete_cargo(id: str)-> bool:
     """Deletes the cargo from datastore if it exists."""
@@ -94,15 +146,24 @@ def delete_cargo(id: str)-> bool:
     if cargo["carrier"]: # Remove cargo from airplane if being carried.
         remove_cargo(str(cargo["carrier"]["id"]), id)
     
-    client.delete(key)
+    model_helpers.run_in_transaction(_delete_cargo, key) # Delete the cargo and uncount it atomically.
     return True
 
+def _delete_cargo(key: object):
+    """Transaction body of delete_cargo, deletes the cargo and uncounts it."""
+    cargo = client.get(key)
+    if cargo: # Skip if a concurrent delete already removed it.
+        model_helpers.delete_multi([cargo])
+        counter_helpers.increment(client, "Cargo", None, -1)
+
 def assign_cargo(airplane_id: str, cargo_id: str)-> tuple:
-    """Receives the airplane_id and cargo_id and assigns the cargo to that airplane."""
-    cargo_key = client.key("Cargo", int(cargo_id))
-    cargo = client.get(cargo_key)
-    airplane_key = client.key("Airplane", int(airplane_id))
-    airplane = client.get(airplane_key)
+    """Receives the airplane_id and cargo_id and assigns the cargo to that airplane. Both are read with one get_multi
+    and written with one put_multi inside a transaction, so concurrent assigns can't overload the airplane."""
+    return model_helpers.run_in_transaction(_assign_cargo, int(airplane_id), int(cargo_id))
+
+def _assign_cargo(airplane_id: int, cargo_id: int)-> tuple:
+    """Transaction body of assign_cargo."""
+    cargo, airplane = get_cargo_and_airplane(cargo_id, airplane_id)
     found, success, capacity = True, True, True
     
     if not cargo or not airplane: # If cargo or airplane not found.
@@ -121,32 +182,90 @@ def assign_cargo(airplane_id: str, cargo_id: str)-> tuple:
     cargos.append({"id": cargo.key.id, "weight": cargo["weight"]})
     cargo.update({"carrier": {"id": airplane.key.id, "tail_number": airplane["tail_number"]}}) # Add carrier to cargo.
     airplane.update({"cargo": cargos}) # Add cargos to cargo of airplane.
-    client.put(cargo)
-    client.put(airplane)
+    model_helpers.put_multi([cargo, airplane])
     
     return found, success, capacity
 
 def remove_cargo(airplane_id: str, cargo_id: str)-> tuple:
-    """Receives airplane_id and cargo_id and removes the cargo from the airplane."""
-    cargo_key = client.key("Cargo", int(cargo_id))
-    cargo = client.get(cargo_key)
-    airplane_key = client.key("Airplane", int(airplane_id))
-    airplane = client.get(airplane_key)
+    """Receives airplane_id and cargo_id and removes the cargo from the airplane. Both are read with one get_multi
+    and written with one put_multi inside a transaction."""
+    return model_helpers.run_in_transaction(_remove_cargo, int(airplane_id), int(cargo_id))
+
+def _remove_cargo(airplane_id: int, cargo_id: int)-> tuple:
+    """Transaction body of remove_cargo."""
+    cargo, airplane = get_cargo_and_airplane(cargo_id, airplane_id)
     found, success = True, True
     
     if not cargo or not airplane: # If cargo or airplane not found.
         found = False
         return found, success
     
-    if not cargo["carrier"] or cargo["carrier"]["id"] != int(airplane_id): # If cargo not on airplane.
+    if not cargo["carrier"] or cargo["carrier"]["id"] != airplane_id: # If cargo not on airplane.
         success = False
         return found, success
     
     cargos = airplane["cargo"]
-    cargos = [cargo for cargo in cargos if cargo["id"] != int(cargo_id)]
+    cargos = [cargo for cargo in cargos if cargo["id"] != cargo_id]
     cargo.update({"carrier": None}) # Remove carrier from cargo.
     airplane.update({"cargo": cargos}) # Remove cargo from airplane.
-    client.put(cargo)
-    client.put(airplane)
+    model_helpers.put_multi([cargo, airplane])
     
     return found, success
+
+def get_cargo_and_airplane(cargo_id: int, airplane_id: int)-> tuple:
+    """Fetches the cargo and the airplane in a single lookup. Returns both, None for any that doesn't exist."""
+    cargo_key = client.key("Cargo", cargo_id)
+    airplane_key = client.key("Airplane", airplane_id)
+    entities = {entity.key: entity for entity in client.get_multi([cargo_key, airplane_key])}
+    return entities.get(cargo_key), entities.get(airplane_key)
+
+def assign_cargos(airplane_id: str, cargo_ids: list, best_effort: bool)-> tuple:
+    """Receives the airplane_id and a list of cargo_ids and assigns them all to that airplane in one transaction, with
+    a single get_multi and a single put_multi. By default nothing is assigned unless every cargo can be, if best_effort
+    every cargo that exists, is unassigned and still fits is assigned in order. Returns whether the airplane was found,
+    whether anything was committed and the per cargo results."""
+    return model_helpers.run_in_transaction(_assign_cargos, int(airplane_id), cargo_ids, best_effort)
+
+def _assign_cargos(airplane_id: int, cargo_ids: list, best_effort: bool)-> tuple:
+    """Transaction body of assign_cargos."""
+    airplane_key = client.key("Airplane", airplane_id)
+    cargo_keys = [client.key("Cargo", cargo_id) for cargo_id in cargo_ids]
+    entities = {entity.key: entity for entity in client.get_multi([airplane_key] + cargo_keys)}
+    airplane = entities.get(airplane_key)
+    
+    if not airplane: # If airplane not found.
+        return False, False, []
+    
+    load = sum(loaded["weight"] for loaded in airplane["cargo"])
+    results, assignable = [], []
+    for key in cargo_keys:
+        cargo = entities.get(key)
+        if not cargo: # If cargo not found.
+            results.append({"id": key.id, "status": "not_found"})
+        elif cargo["carrier"] is not None: # If cargo already on an airplane.
+            results.append({"id": key.id, "status": "already_assigned"})
+        elif best_effort and load + cargo["weight"] > airplane["capacity"]: # If this cargo doesn't fit anymore.
+            results.append({"id": key.id, "status": "insufficient_capacity"})
+        else:
+            load += cargo["weight"]
+            assignable.append(cargo)
+            results.append({"id": key.id, "status": "assigned"})
+    
+    if not best_effort: # All or nothing, any failure or going over capacity cancels every assignment.
+        over_capacity = load > airplane["capacity"]
+        if over_capacity or len(assignable) != len(cargo_keys):
+            for result in results:
+                if result["status"] == "assigned":
+                    result["status"] = "insufficient_capacity" if over_capacity else "not_assigned"
+            return True, False, results
+    
+    if not assignable:
+        return True, False, results
+    
+    carrier = {"id": airplane.key.id, "tail_number": airplane["tail_number"]}
+    for cargo in assignable:
+        airplane["cargo"].append({"id": cargo.key.id, "weight": cargo["weight"]})
+        cargo.update({"carrier": dict(carrier)}) # Add carrier to cargo.
+    model_helpers.put_multi([airplane] + assignable)
+    
+    return True, True, results
@@ -1,29 +1,99 @@
-from google.cloud import datastore
+import time
+from helpers.import_helpers import lazy_import
+import helpers.client_helpers as client_helpers
+import helpers.model_helpers as model_helpers
+import helpers.cursor_helpers as cursor_helpers
+from helpers.cache_helpers import TTLCache
+from constants import USER_CACHE_SIZE, USER_CACHE_TTL
 
-# Datastore client to interact with database.
-client = datastore.Client()
+datastore = lazy_import("google.cloud.datastore")
+
+# Datastore client to interact with database, shared by every model.
+client = client_helpers.client
+
+# Users are keyed by their sub so checking one is a single lookup, subs already seen skip even that.
+_known_subs = TTLCache(USER_CACHE_SIZE)
 
 def create_user(sub: str)-> object:
     """Receives user jwt and creates it on google datastore."""
-    key = client.key("User")
-    new_user = datastore.Entity(key)
+    new_user = datastore.Entity(client.key("User", sub))
     
     new_user.update({"ID": sub})
     client.put(new_user)
+    _known_subs.set(sub, True, time.time() + USER_CACHE_TTL)
+
+def cursor_scope(keys_only: bool) -> str:
+    """Returns the listing a GET /users cursor is bound to. Keys-only and projection queries can't resume each other's
+    cursors, so they're separate listings."""
+    return cursor_helpers.scope("User", None) + (":keys_only" if keys_only else "")
+
+def get_users(base_url: str, q_limit: str, cursor: bytes = None, keys_only: bool = False)-> dict:
+    """Function returns a page of users from the google datastore along with the next url. Only the ID property is
+    fetched with a projection query, or only the keys if keys_only."""
+    query = client.query(kind="User")
+    if keys_only:
+        query.keys_only()
+    else:
+        query.projection = ["ID"]
+    query.order = ["ID"] # Stable order across pages, served by the built-in ID index.
+    l_iterator = query.fetch(limit=int(q_limit), start_cursor=cursor)
+    results = list(next(l_iterator.pages)) # Fetch result of query in list form
+    
+    if l_iterator.next_page_token: # Create the next url using limit and a signed cursor.
+        next_cursor = cursor_helpers.encode_cursor(l_iterator.next_page_token, cursor_scope(keys_only))
+        next_url = base_url + "?limit=" + q_limit + "&cursor=" + next_cursor + ("&keys_only=true" if keys_only else "")
+    else:
+        next_url = None
+    
+    if keys_only:
+        return {"keys": [user.key.name or user.key.id for user in results], "next": next_url}
+    return {"users": [{"ID": user["ID"]} for user in results], "next": next_url}
 
-def get_users()-> list:
-    """Function returns all users that have been created from the google datastore."""
+def export_users()-> object:
+    """Yields every user, fetched batch by batch by the query iterator so the full list is never held in memory."""
     query = client.query(kind="User")
-    results = list(query.fetch()) # Fetch result of query in list form
-    users = [dict(user) for user in results]
-    return users
+    query.projection = ["ID"]
+    for user in query.fetch():
+        yield {"ID": user["ID"]}
 
 def user_exists(sub: str) -> bool:
     """Checks if passed sub matches a created user."""
-    query = client.query(kind="User")
-    query.add_filter('ID', '=', sub)
-    results = list(query.fetch()) # Fetch result of query in list form.
+    if _known_subs.get(sub): # Seen recently.
+        return True
     
-    if results: # If user exists.
+    if client.get(client.key("User", sub)): # If user exists.
+        _known_subs.set(sub, True, time.time() + USER_CACHE_TTL)
         return True
-    return False # If user does not exist.
\ No newline at end of file
+    return False # If user does not exist.
+
+def get_stats() -> dict:
+    """Returns the counters of the known subs cache."""
+    return _known_subs.stats()
+
+def ensure_user(sub: str) -> bool:
+    """Creates the user for passed sub unless it already exists. Safe to call concurrently for the same sub, the check
+    and the creation run in one transaction. Returns True if the user was created."""
+    if user_exists(sub):
+        return False
+    
+    # Users created before they were keyed by sub have an id key, look them up once so they're migrated, not duplicated.
+    query = client.query(kind="User")
+    query.add_filter("ID", "=", sub)
+    query.keys_only()
+    legacy_keys = [user.key for user in query.fetch()]
+    
+    created = model_helpers.run_in_transaction(_get_or_create_user, sub, legacy_keys)
+    _known_subs.set(sub, True, time.time() + USER_CACHE_TTL)
+    return created
+
+def _get_or_create_user(sub: str, legacy_keys: list) -> bool:
+    """Transaction body of ensure_user, creates the user keyed by sub if missing and deletes legacy copies."""
+    key = client.key("User", sub)
+    if client.get(key): # Created by a concurrent login.
+        return False
+    
+    new_user = datastore.Entity(key)
+    new_user.update({"ID": sub})
+    client.put(new_user)
+    client.delete_multi(legacy_keys)
+    return not legacy_keys # Migrating an existing user isn't a creation.
@@ -0,0 +1,83 @@
+"""Production server settings, a gunicorn config file:
+    gunicorn -c serving.py main:app
+or python serving.py which does the same. Each worker process runs threads, the count of both is derived from the CPU
+count and the share of request time spent waiting on I/O, see constants.py. The app is loaded once in the master and
+the workers are forked from it, so modules, the JWKS keys and caches filled at startup are shared copy-on-write. The
+Datastore client isn't, gRPC channels don't survive a fork so every worker builds its own."""
+import glob
+import math
+import os
+import tempfile
+from constants import SERVING_IO_WAIT, SERVING_MAX_THREADS, SERVING_TIMEOUT, SERVING_GRACEFUL_TIMEOUT
+
+# Workers write their metrics here so /metrics sums every worker.
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "cloud-portfolio-metrics"))
+
+def cpu_count() -> int:
+    """Returns the CPUs this process may run on."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError: # Not available on every platform.
+        return os.cpu_count() or 1
+
+def io_wait() -> float:
+    """Returns the share of request time spent waiting on I/O, the environment variable overrides constants.py."""
+    return min(max(float(os.environ.get("SERVING_IO_WAIT", SERVING_IO_WAIT)), 0.0), 0.99)
+
+def default_threads() -> int:
+    """Returns the threads per worker that keep its CPU busy while the others wait, 1 / (1 - io_wait)."""
+    return min(math.ceil(1 / (1 - io_wait())), SERVING_MAX_THREADS)
+
+def default_workers() -> int:
+    """Returns one worker per CPU, threads already cover the I/O wait and the GIL lets a worker use one CPU."""
+    return cpu_count()
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}" # App Engine sets PORT.
+workers = int(os.environ.get("WEB_CONCURRENCY", default_workers()))
+threads = int(os.environ.get("SERVING_THREADS", default_threads()))
+worker_class = "gthread" if threads > 1 else "sync"
+os.environ["WEB_CONCURRENCY"] = str(workers) # Read by the app, a per process entity cache is off with several workers.
+preload_app = True
+timeout = SERVING_TIMEOUT
+graceful_timeout = SERVING_GRACEFUL_TIMEOUT # On SIGTERM workers stop accepting and finish their requests first.
+keepalive = 5
+
+def on_starting(server: object):
+    """Drops the metrics of a previous run."""
+    os.makedirs(os.environ["METRICS_DIR"], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "metrics-*.json")):
+        os.remove(path)
+
+def when_ready(server: object):
+    """Imports the lazily imported modules and fetches the JWKS once in the master so every worker starts with them.
+    No Datastore client is built, the workers build their own."""
+    import helpers.import_helpers as import_helpers
+    import helpers.jwks_helpers as jwks_helpers
+    import_helpers.load_all()
+    try:
+        jwks_helpers.refresh_keys()
+    except Exception as e: # Workers fetch them on first use instead.
+        server.log.warning(f"JWKS prefetch failed: {e}")
+    server.log.info(f"{workers} workers, {threads} threads each, {cpu_count()} CPUs, I/O wait {io_wait():.0%}")
+
+def post_fork(server: object, worker: object):
+    """Gives the worker its own Datastore client and JWKS refresh timer, threads aren't copied by fork."""
+    import helpers.client_helpers as client_helpers
+    import helpers.jwks_helpers as jwks_helpers
+    client_helpers.reset()
+    client_helpers.warm_up()
+    jwks_helpers.after_fork()
+
+def worker_exit(server: object, worker: object):
+    """Writes the worker's final metrics once it drained."""
+    import helpers.metrics_helpers as metrics_helpers
+    try:
+        metrics_helpers.flush()
+    except OSError as e:
+        server.log.warning(f"Metrics flush failed: {e}")
+
+if __name__ == "__main__":
+    import sys
+    from gunicorn.app.wsgiapp import run
+    sys.argv = ["gunicorn", "-c", __file__, "main:app"] + sys.argv[1:]
+    run()